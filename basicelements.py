@@ -2,22 +2,26 @@
 
 import time
 import os
+import math
 import itertools
-import dbus
-import select
-import alsaaudio
-from dbus.exceptions import DBusException
-from mpdclient2 import connect
-from dzentools import BarElement, ForegroundColour, Icon, DzenString
+from dzentools import BarElement, ForegroundColour, Icon, DzenString, Template
+from dzentools import Graph
+from procfs import AttrFile, MountTable, ProcFile, StatSampler, procfile_parse
+from scheduler import PushMixin
 
 BLUE = ForegroundColour("blue")
 RED = ForegroundColour("red")
 LBLUE = ForegroundColour("lightblue")
-ICONS = Icon(os.path.dirname(__file__) + "/icons")
+ICONS = Icon(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "icons"))
+
+def make_graph(params, high=1.0):
+    '''Graph set up by the 'graph' (width, 0 for none) and 'graph_height'
+    element params, or None'''
+    if not params.get('graph'):
+        return None
+    return Graph(params['graph'], params.get('graph_height', 10), high=high)
 
-def procfile_parse(stream):
-    ret = (line.split(':', 1) for line in stream if ':' in line)
-    return dict((k.strip(), v.strip()) for k,v in ret)
 
 class Time(BarElement):
     DEFAULT_PARAMS = dict(fmt="%A %d %b %H:%M:%S")
@@ -26,65 +30,170 @@ class Time(BarElement):
 
 class Load(BarElement):
     DEFAULT_PARAMS = dict(colour=BLUE, icon="load.xbm")
+    INTERVAL = 5
+    def start(self):
+        self.template = Template(" {0:.2f} {1:.2f} {2:.2f}",
+                icon=ICONS[self.params['icon']])
+        self.graph = make_graph(self.params, high=None)
+
     def update(self):
-        ret = ICONS[self.params['icon']]
-        ret += " {0:.2f} {1:.2f} {2:.2f}".format(*os.getloadavg())
+        load = os.getloadavg()
+        ret = self.template(*load)
+        if self.graph:
+            ret += " " + self.graph.push(load[0])
         return ret
 
 
+def read_attr(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
 class Battery(BarElement):
+    '''charge of the batteries listed in /sys/class/power_supply
+
+    full and design capacities and alarm levels are read once, and again
+    only when a charging status changes; an update reads the charge and the
+    status of every battery from files kept open. the interval adapts to
+    the state: max_interval on AC, doubling up to it while the shown level
+    doesn't move, min_interval near the warning level. `warning` is the
+    level used for batteries without an alarm attribute, `batteries` the
+    names of the ones shown (all by default); with `combined` a single
+    level is shown for all of them.
+    '''
     DEFAULT_PARAMS = {
-        'battdir': "/proc/acpi/battery/BAT0", 
+        'supply_dir': "/sys/class/power_supply",
+        'batteries': None,
+        'combined': False,
+        'warning': 0.1,
+        'min_interval': 2,
+        'max_interval': 60,
         'icon_bat': "power-bat.xbm",
         'icon_ac': "power-ac.xbm",
         'colour_normal': LBLUE, 
         'colour_warning': RED,
         }
+    INTERVAL = 10
+
+    def start(self):
+        ICONS.validate(self.params['icon_bat'], self.params['icon_ac'])
+        self.base_interval = self.interval
+        self.batteries = None
+        self.statuses = None
+        self.quantity = None
+        self._text = None
+        self._templates = {}
+        self.graph = make_graph(self.params)
+
+    def _scan(self):
+        '''open the changing attributes and read the static ones'''
+        supply_dir = self.params['supply_dir']
+        names = self.params['batteries'] or sorted(name
+                for name in os.listdir(supply_dir) if read_attr(os.path.join(
+                    supply_dir, name, "type")) == "Battery")
+        batteries = []
+        for name in names:
+            path = os.path.join(supply_dir, name)
+            attr = lambda filename: os.path.join(path, filename)
+            if (os.path.exists(attr("present"))
+                    and read_attr(attr("present")) == "0"):
+                continue
+            unit = "energy" if os.path.exists(attr("energy_now")) \
+                    else "charge"
+            full = int(read_attr(attr(unit + "_full")))
+            alarm = int(read_attr(attr("alarm"))) \
+                    if os.path.exists(attr("alarm")) else 0
+            batteries.append((AttrFile(attr(unit + "_now")),
+                AttrFile(attr("status")), full, alarm))
+        return batteries
+
+    def _close(self):
+        for now, status, full, alarm in self.batteries or ():
+            now.close()
+            status.close()
+        self.batteries = None
+
+    def stop(self):
+        self._close()
 
     def update(self):
-        battdir = self.params['battdir']
-        info = {}
-        with open(battdir + "/info") as f:
-            info = procfile_parse(f)
-        with open(battdir +  "/state") as f:
-            state = procfile_parse(f)
-        self.total_capacity = int(info["design capacity"].split()[0])
-        self.max_capacity = int(info["last full capacity"].split()[0])
-        self.warning = int(info["design capacity warning"].split()[0])
-        self.capacity = int(state["remaining capacity"].split()[0])
-        #self.low = int(info["design capacity low"].split()[0])
-
-        self.bat_status = state["charging state"].strip()
-        if self.bat_status == "discharging":
-            my_icon = self.params['icon_bat'] 
+        if self.batteries is None:
+            self.batteries = self._scan()
+            self.statuses = None
+        try:
+            statuses = [status.read() for now, status, full, alarm
+                    in self.batteries]
+            if self.statuses is not None and statuses != self.statuses:
+                self._close()
+                self.batteries = self._scan()
+                statuses = [status.read() for now, status, full, alarm
+                        in self.batteries]
+            self.statuses = statuses
+            charges = [int(now.read()) for now, status, full, alarm
+                    in self.batteries]
+        except (IOError, OSError, ValueError):
+            self._close()
+            raise
+        fulls = [full for now, status, full, alarm in self.batteries]
+        alarms = [alarm for now, status, full, alarm in self.batteries]
+        discharging = "Discharging" in statuses
+
+        if not self.batteries:
+            text, quantity, warning = "AC", None, 0
+        else:
+            quantity = float(sum(charges)) / sum(fulls)
+            if all(alarms):
+                warning = float(sum(alarms)) / sum(fulls)
+            else:
+                warning = self.params['warning']
+            if self.params['combined']:
+                text = "{0:.0%}".format(quantity)
+            else:
+                text = "/".join("{0:.0%}".format(float(charge) / full)
+                        for charge, full in zip(charges, fulls))
+
+        if not discharging:
+            self.interval = self.params['max_interval']
+        elif quantity <= 2 * warning:
+            self.interval = self.params['min_interval']
+        elif text == self._text:
+            self.interval = min(self.interval * 2,
+                    self.params['max_interval'])
         else:
-            my_icon = self.params['icon_ac']
+            self.interval = self.base_interval
+        self.quantity, self._text = quantity, text
 
-        if self.capacity <= self.warning:
+        my_icon = self.params['icon_bat' if discharging else 'icon_ac']
+        if quantity is not None and quantity <= warning:
             my_col = self.params['colour_warning']
         else:
             my_col = self.params['colour_normal']
-
-        self.quantity = float(self.capacity)/self.max_capacity
-        self.quality = float(self.max_capacity)/self.total_capacity
-        ret = " {quantity:.0%}"
-        return my_col(ICONS[my_icon] + ret.format(**self.__dict__))
+        template = self._templates.get((my_icon, my_col))
+        if template is None:
+            template = Template(" {0}", icon=ICONS[my_icon], colour=my_col)
+            self._templates[my_icon, my_col] = template
+        ret = template(text)
+        if self.graph and quantity is not None:
+            ret += " " + self.graph.push(quantity)
+        return ret
 
 
 class MprisPlayer(BarElement):
     DEFAULT_PARAMS = dict(app="org.mpris.vlc")
 
     def start(self):
+        import dbus
         self.application = self.params['app']
         self.bus = dbus.SessionBus()
+        self.DBusException = dbus.exceptions.DBusException
 
     def update(self):
         try:
             mpris = self.bus.get_object(self.application, "/Player")
             metadata = mpris.GetMetadata()
             if not metadata :
-                raise DBusException
-        except DBusException:
+                raise self.DBusException
+        except self.DBusException:
             return "Not Playing"
         else:
             metadata = dict((str(k), unicode(v).encode("utf-8", "replace")) 
@@ -94,24 +203,59 @@ class MprisPlayer(BarElement):
             + metadata.get('artist', "No artist")))
 
 
-class Audio(BarElement):
+class Audio(PushMixin, BarElement):
+    '''volume of the default mixer
+
+    one mixer handle is kept open, its poll descriptors are watched and its
+    events consumed with handleevents(), so volume and mute are read again
+    only when ALSA reports a change. pyalsaaudio versions without
+    handleevents() can't drain the events: a new mixer is opened at every
+    update instead.
+    '''
     DEFAULT_PARAMS = {
             'icon': 'vol-hi.xbm',
             'icon_mute': 'vol-mute.xbm',
             'colour': LBLUE,
             }
     def start(self):
+        import alsaaudio
+        import select
+        super(Audio, self).start()
+        self.Mixer = alsaaudio.Mixer
+        self._mixer = alsaaudio.Mixer()
+        self._events = hasattr(self._mixer, 'handleevents')
+        descriptors = self._mixer.polldescriptors()
+        self._fds = [fd for fd, mask in descriptors]
         self._poll = select.poll()
-        self._poll.register(*alsaaudio.Mixer().polldescriptors()[0])
+        for fd, mask in descriptors:
+            self._poll.register(fd, mask)
+        self._templates = [Template(" {0}%", icon=ICONS[self.params[icon]])
+                for icon in ('icon', 'icon_mute')]
+        self.graph = make_graph(self.params)
 
     def check_update(self):
-        return self._poll.poll(0)
-    
+        if not self._events:
+            return True
+        if self._poll.poll(0):
+            self._mixer.handleevents()
+            self._pushed = True
+        return super(Audio, self).check_update()
+
+    def wakeup_fds(self):
+        return self._fds if self._events else []
+
+    def handle_wakeup(self, fd):
+        self._mixer.handleevents()
+        self._pushed = True
+
     def update(self):
-        master = alsaaudio.Mixer()
-        state = self.params['icon_mute' if master.getmute()[0] else 'icon']
-        vol = master.getvolume()[0]
-        return (ICONS[state] + " {0}%".format(vol))
+        master = self._mixer if self._events else self.Mixer()
+        template = self._templates[bool(master.getmute()[0])]
+        volume = master.getvolume()[0]
+        ret = template(volume)
+        if self.graph:
+            ret += " " + self.graph.push(volume / 100.0)
+        return ret
 
 
 class MocpPlayer(BarElement):
@@ -122,16 +266,31 @@ class MocpPlayer(BarElement):
         return ret or "Not Playing"
 
 
-class MpdPlayer(BarElement):
+class MpdPlayer(PushMixin, BarElement):
+    DEFAULT_PARAMS = {
+        'host': os.environ.get("MPD_HOST", "localhost"),
+        'port': int(os.environ.get("MPD_PORT", 6600)),
+        'password': None,
+        }
+
     def start(self):
-        self.conn = connect()
+        super(MpdPlayer, self).start()
+        from mpdidle import MpdWatcher
+        self.watcher = MpdWatcher(self.params['host'], self.params['port'],
+                self.params['password'], changed=self.push)
+
+    def stop(self):
+        self.watcher.stop()
+        super(MpdPlayer, self).stop()
 
     def update(self):
-        _song = self.conn.currentsong()
+        _song = self.watcher.song
+        if _song is None:
+            return "MPD: {0}".format(self.watcher.error or "connecting")
         song = lambda x: _song.get(x, '')
-        song_name = song('artist')
+        song_name = song('Artist')
         if song_name: song_name += ' - '
-        song_name += song('title') or song('file')
+        song_name += song('Title') or song('file')
         return song_name or "Not Playing"
 
 
@@ -140,14 +299,83 @@ class Memory(BarElement):
             'icon': "mem.xbm",
             'colour': BLUE,
             }
+    INTERVAL = 2
+    def start(self):
+        self._meminfo = ProcFile("/proc/meminfo", ("MemTotal", "Committed_AS"))
+        self.template = Template(" {0:0.2%}", icon=ICONS[self.params['icon']])
+        self.graph = make_graph(self.params)
+
     def update(self):
-        with open("/proc/meminfo") as f:
-            meminfo = procfile_parse(f)
-        mem_total = float(meminfo["MemTotal"][:-2])
-        mem_needed = float(meminfo["Committed_AS"][:-2])
-        ret = ICONS[self.params['icon']] 
-        ret += " {0:0.2%}".format((mem_needed)/mem_total)
-        return (ret)
+        mem_total, mem_needed = (float(v) for v in self._meminfo.values())
+        ret = self.template(mem_needed / mem_total)
+        if self.graph:
+            ret += " " + self.graph.push(mem_needed / mem_total)
+        return ret
+
+
+SIZE_UNITS = ('', 'K', 'M', 'G', 'T', 'P', 'E')
+
+
+def human_size(size):
+    '''size in bytes, rounded up and formatted like df -h does'''
+    i = 0
+    while size >= 1024 and i < len(SIZE_UNITS) - 1:
+        size /= 1024.0
+        i += 1
+    if i and size < 10 and math.ceil(size * 10) < 100:
+        return "{0:.1f}{1}".format(math.ceil(size * 10) / 10, SIZE_UNITS[i])
+    size = math.ceil(size)
+    if size >= 1024 and i < len(SIZE_UNITS) - 1:
+        # rounding up reached the next unit
+        return "1.0" + SIZE_UNITS[i + 1]
+    return "{0:.0f}{1}".format(size, SIZE_UNITS[i])
+
+
+class Cpu(BarElement):
+    '''busy CPU percentage, overall or of one core ('core': n or "all")'''
+    DEFAULT_PARAMS = {
+            'icon': "cpu.xbm",
+            'colour': BLUE,
+            'core': None,
+            }
+
+    def start(self):
+        self.sampler = StatSampler.shared()
+        self.template = None
+
+    def update(self):
+        self.sampler.sample()
+        usage = self.sampler.usage()
+        core = self.params['core']
+        if core == "all":
+            usage = usage[1:]
+        else:
+            usage = [usage[0 if core is None else core + 1]]
+        if self.template is None:
+            self.template = Template(" {:.0%}" * len(usage),
+                    icon=ICONS[self.params['icon']])
+        return self.template(*usage)
+
+
+class Network(BarElement):
+    DEFAULT_PARAMS = {
+            'interface': "eth0",
+            'icon_down': "down.xbm",
+            'icon_up': "up.xbm",
+            'colour': BLUE,
+            }
+
+    def start(self):
+        self.sampler = StatSampler.shared()
+        self.down = Template(" {0}/s ", icon=ICONS[self.params['icon_down']])
+        self.up = Template(" {0}/s", icon=ICONS[self.params['icon_up']])
+
+    def update(self):
+        self.sampler.sample()
+        rates = self.sampler.rates(self.params['interface'])
+        if rates is None:
+            return "{0}: down".format(self.params['interface'])
+        return self.down(human_size(rates[0])) + self.up(human_size(rates[1]))
 
 
 class DiskUsage(BarElement):
@@ -157,36 +385,76 @@ class DiskUsage(BarElement):
             ("vista", "/mnt/vista"), 
             ("usb", "/media/usbstick")
             ),
+        'fmt': "{name}: {use}",
         'colour': BLUE,
         }
+    INTERVAL = 10
+
+    def start(self):
+        self.mounts = MountTable()
+
+    def usage(self, name, path):
+        st = os.statvfs(path)
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        avail = st.f_bavail * st.f_frsize
+        total = used + avail
+        return self.params['fmt'].format(name=name,
+            use="{0:.0f}%".format(math.ceil(100.0 * used / total)
+                if total else 0),
+            size=human_size(st.f_blocks * st.f_frsize),
+            used=human_size(used), avail=human_size(avail))
 
     def update(self):
-        MPTS = self.params['partitions']
-        data = os.popen("df -Ph")
-        ret = dict(line.split()[:-3:-1] for line in data if "/" in line)
-        ret = " ".join("{0}: {1}".format(k, ret.get(v, 'UNM')) for k, v in MPTS)
-        return (ret)
+        return " ".join(self.usage(k, v) if v in self.mounts
+                else "{0}: UNM".format(k)
+                for k, v in self.params['partitions'])
 
 
-class IMAPRecent(BarElement):
+class IMAPRecent(PushMixin, BarElement):
+    '''unseen messages of an IMAP mailbox, pushed by the server with IDLE
+
+    the account is read from `acct-file`, "key: value" lines with host,
+    user, password and optionally port, mailbox and ssl ("no" to connect in
+    clear text). the network waits happen in the thread of an ImapWatcher,
+    shared by the elements showing the same account. `wait` is the period
+    used to search mailboxes of servers not supporting IDLE, and `cmd` is
+    run when the element is clicked.
+    '''
     DEFAULT_PARAMS = {
             'cmd' : "xclock",
             'acct-file': None,
             'wait' : 10*60,
+            'fmt': "mail: {0}",
             }
     def start(self):
-        self._lasttime = time.time()
-
-    def check_update(self):
-        now = time.time()
-        if now - self._lasttime > self.params['wait']:
-            self._lasttime = now
-            return True
-        else:
-            return False
+        super(IMAPRecent, self).start()
+        self.watcher = None
+        if self.params['acct-file'] is None:
+            return
+        with open(os.path.expanduser(self.params['acct-file'])) as f:
+            account = procfile_parse(f)
+        from imapidle import ImapWatcher
+        use_ssl = account.get('ssl', "yes") != "no"
+        self.watcher = ImapWatcher.shared(self.push,
+                host=account['host'],
+                port=int(account.get('port', 993 if use_ssl else 143)),
+                user=account.get('user'), password=account.get('password'),
+                mailbox=account.get('mailbox', "INBOX"), use_ssl=use_ssl,
+                poll=self.params['wait'])
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.release(self.push)
+        super(IMAPRecent, self).stop()
 
     def update(self):
-        return DzenString(("ca", self.params['cmd']), ("ca", ""))
+        if self.watcher is None:
+            text = ""
+        elif self.watcher.unseen is None:
+            text = "mail: {0}".format(self.watcher.error or "connecting")
+        else:
+            text = self.params['fmt'].format(self.watcher.unseen)
+        return DzenString(("ca", "1," + self.params['cmd']), text, ("ca", ""))
 
 if __name__ == "__main__":
     lines = itertools.izip(Time(), Load(), Battery(), 
@@ -0,0 +1,261 @@
+#!/usr/bin/python2
+'''benchmarks for the rendering hot path
+
+every benchmark builds a "tick" function once and times it. for each one
+the time per tick and the peak RSS of a forked child running only that
+benchmark are reported, and compared against the baselines stored in
+benchmarks.json. allocations per tick are not: python 2 has no allocation
+counter outside debug builds, and the gc counts only move with the objects
+left alive, which the hot path doesn't do.
+the startup benchmarks time a whole python process instead: importing and
+creating a minimal Time+Load bar through the registry, against importing
+every element module with those of its backends that are installed.
+
+usage: benchmarks.py [--save] [name ...]
+    --save  store the results as the new baselines
+'''
+
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import traceback
+import types
+
+from dzentools import DzenString, ForegroundColour, BarElement, Graph, Icon
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES = os.path.join(BASEDIR, "benchmarks.json")
+TOLERANCE = 1.25
+BENCHMARKS = []
+# run by the child of measure() once its benchmark is done
+CLEANUPS = []
+STARTUP = [
+    ("startup_minimal", "import registry\n"
+        "registry.create('Time').next()\nregistry.create('Load').next()"),
+    ("startup_full", "import basicelements, notification, mpris\n"
+        "import mpdidle, imapidle\n"
+        "for name in ('dbus', 'gobject', 'alsaaudio'):\n"
+        "    try:\n"
+        "        __import__(name)\n"
+        "    except ImportError:\n"
+        "        pass"),
+]
+
+
+def benchmark(setup):
+    '''register a function returning the tick to be measured'''
+    BENCHMARKS.append(setup)
+    return setup
+
+
+@benchmark
+def dzenstring_concat():
+    icon = ('i', '/usr/share/icons/load.xbm')
+    def tick():
+        ret = DzenString(icon)
+        for i in range(10):
+            ret += " a^b "
+            ret += DzenString(('fg', 'red'), str(i), ('fg', ''))
+        return str(ret)
+    return tick
+
+
+@benchmark
+def colour_nested():
+    outer, inner = ForegroundColour("blue"), ForegroundColour("red")
+    def tick():
+        ret = DzenString(("i", "icon.xbm"), " ")
+        for i in range(5):
+            ret = outer(inner("inner") + ret + " outer")
+        return str(ret)
+    return tick
+
+
+@benchmark
+def barelement_next():
+    elm = BarElement(dict(colour=ForegroundColour("blue")), size=20, scroll=1)
+    elm.update = lambda: DzenString(("i", "x.xbm"), " scrolling text^")
+    return elm.next
+
+
+@benchmark
+def icon_lookup():
+    icons = Icon(os.path.join(BASEDIR, "icons"))
+    names = ["load.xbm", "mem.xbm", "power-ac.xbm", "vol-hi.xbm"]
+    def tick():
+        for name in names:
+            icons[name]
+    return tick
+
+
+@benchmark
+def graph_push():
+    # autoscaled over 60 columns, fed values whose maximum seldom changes
+    graph = Graph(60)
+    pushes = itertools.cycle([float(i * 37 % 100) for i in range(100)])
+    def tick():
+        return graph.push(next(pushes))
+    return tick
+
+
+def fake_system():
+    '''fake modules and system sources used by basicelements'''
+    dbus = types.ModuleType("dbus")
+    dbus.exceptions = types.ModuleType("dbus.exceptions")
+    class DBusException(Exception):
+        pass
+    dbus.exceptions.DBusException = DBusException
+    class Player(object):
+        def GetMetadata(self):
+            return {"title": u"Title", "artist": u"Artist"}
+    class SessionBus(object):
+        def get_object(self, name, path):
+            return Player()
+    dbus.SessionBus = SessionBus
+
+    alsaaudio = types.ModuleType("alsaaudio")
+    mixer_fd, mixer_wfd = os.pipe()
+    CLEANUPS.extend([lambda: os.close(mixer_fd), lambda: os.close(mixer_wfd)])
+    class Mixer(object):
+        def polldescriptors(self):
+            return [(mixer_fd, 1)]
+        def handleevents(self):
+            pass
+        def getmute(self):
+            return [0]
+        def getvolume(self):
+            return [42]
+    alsaaudio.Mixer = Mixer
+    sys.modules.update({"dbus": dbus, "dbus.exceptions": dbus.exceptions,
+        "alsaaudio": alsaaudio})
+
+    supply_dir = tempfile.mkdtemp()
+    CLEANUPS.append(lambda: shutil.rmtree(supply_dir, ignore_errors=True))
+    for name, attrs in (("BAT0", dict(type="Battery", status="Discharging",
+            energy_now="30000000", energy_full="40000000")),
+            ("AC", dict(type="Mains", online="0"))):
+        os.mkdir(os.path.join(supply_dir, name))
+        for attr, value in attrs.items():
+            with open(os.path.join(supply_dir, name, attr), "w") as f:
+                f.write(value + "\n")
+    mocp = "State: PLAY\nFile: /music/song.ogg\nTitle: Artist - Song\n"
+    os.popen = lambda cmd, *args: iter(mocp.splitlines(True))
+    return supply_dir
+
+
+@benchmark
+def full_line():
+    supply_dir = fake_system()
+    import basicelements
+    import mpdidle
+    class FakeWatcher(object):
+        def __init__(self, *args, **kwargs):
+            self.song = {"Artist": "Artist", "Title": "Title"}
+    mpdidle.MpdWatcher = FakeWatcher
+    b = basicelements
+    elements = (b.MpdPlayer(size=40, scroll=1), b.MprisPlayer(),
+        b.MocpPlayer(), b.DiskUsage(dict(partitions=(("/", "/"),
+        ("usb", "/media/nonexistent")))), b.Audio(), b.Memory(),
+        b.Battery(dict(supply_dir=supply_dir)), b.Load(), b.Time(), b.IMAPRecent())
+    def tick():
+        return " ".join(elm.next() for elm in elements)
+    return tick
+
+
+def measure(setup, number):
+    '''run a benchmark in a forked child, return its results as a dict'''
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        status = 0
+        try:
+            tick = setup()
+            tick()
+            best = min(timeit.repeat(tick, number=number, repeat=3))
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            with os.fdopen(wfd, "w") as f:
+                json.dump(dict(usec=best / number * 1e6, peak_kb=peak), f)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # os._exit() skips every other cleanup of the child
+            for cleanup in CLEANUPS:
+                cleanup()
+        os._exit(status)
+    os.close(wfd)
+    with os.fdopen(rfd) as f:
+        data = f.read()
+    if os.waitpid(pid, 0)[1]:
+        raise RuntimeError("benchmark {0} failed".format(setup.__name__))
+    return json.loads(data)
+
+
+def measure_startup(code, number=5):
+    '''run code in new python processes, return the best run as a dict'''
+    best, peak = None, 0
+    with open(os.devnull, "w") as devnull:
+        for i in range(number):
+            start = time.time()
+            proc = subprocess.Popen([sys.executable, "-c", code],
+                    cwd=BASEDIR, stdout=devnull, stderr=devnull)
+            pid, status, usage = os.wait4(proc.pid, 0)
+            elapsed = time.time() - start
+            if status:
+                return None
+            best = elapsed if best is None else min(best, elapsed)
+            peak = max(peak, usage.ru_maxrss)
+    return dict(usec=best * 1e6, peak_kb=peak)
+
+
+def main(args):
+    save = "--save" in args
+    names = [arg for arg in args if not arg.startswith("--")]
+    try:
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+    except IOError:
+        baselines = {}
+    failed = False
+    print("{0:<18} {1:>10} {2:>10}  {3}".format(
+        "benchmark", "us/tick", "peak KiB", "baseline"))
+    runs = [(setup.__name__, lambda setup=setup: measure(setup, 2000))
+            for setup in BENCHMARKS]
+    runs += [(name, lambda code=code: measure_startup(code))
+            for name, code in STARTUP]
+    for name, run in runs:
+        if names and name not in names:
+            continue
+        result = run()
+        base = baselines.get(name)
+        if result is None:
+            print("{0:<18} unavailable (the code failed)".format(name))
+            continue
+        elif base is None:
+            status = "new"
+        elif result["usec"] > base["usec"] * TOLERANCE:
+            status = "SLOWER than {0:.2f} us".format(base["usec"])
+            failed = True
+        else:
+            status = "ok ({0:+.0%})".format(result["usec"] / base["usec"] - 1)
+        print("{0:<18} {usec:>10.2f} {peak_kb:>10d}  "
+              "{1}".format(name, status, **result))
+        if save:
+            baselines[name] = result
+    if save:
+        with open(BASELINES, "w") as f:
+            json.dump(baselines, f, indent=1, sort_keys=True,
+                    separators=(',', ': '))
+    return 1 if failed and not save else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+'''config module
+bars described by a JSON file instead of python constants:
+
+    {"bars": [{"args": "-ta r -y 782",
+               "elements": [{"type": "MpdPlayer", "size": 40, "scroll": 1},
+                            {"type": "Load", "interval": 10,
+                             "params": {"colour": "green"}},
+                            {"type": "Time"}]}]}
+
+every element takes the registry name of its class in "type" and optional
+"params", "interval" and "timeout"; "size", "scroll" and "colour" only set
+how it is shown on that bar. params whose name starts with "colour" are
+given as colour names. elements defined the same way are the same element,
+updated once even if shown on several bars.
+
+the file is read again when it changes. elements whose definition didn't
+change are kept as they are, with their connections, caches and state,
+only the new ones are created and the dropped ones stopped. a dropped
+element holding something only one element can have (see
+BarElement.EXCLUSIVE) is stopped before its replacement is created, and
+started again if the new configuration is refused.
+'''
+
+import json
+import os
+import sys
+
+import registry
+from dzentools import ForegroundColour, View
+
+
+class ConfigError(Exception):
+    pass
+
+
+def element_key(spec):
+    '''what identifies an element in the configuration'''
+    return json.dumps([spec["type"], spec.get("params", {}),
+        spec.get("interval"), spec.get("timeout")], sort_keys=True)
+
+
+def check_spec(spec):
+    '''raise ValueError if the element definition spec is malformed'''
+    if not isinstance(spec, dict) or \
+            not isinstance(spec.get("type"), basestring):
+        raise ValueError("element without a type: {0!r}".format(spec))
+    params = spec.get("params", {})
+    if not isinstance(params, dict):
+        raise ValueError("params are not an object: {0!r}".format(params))
+    colours = [value for key, value in params.items()
+            if key.startswith("colour")] + [spec.get("colour")]
+    for colour in colours:
+        if colour is not None and not isinstance(colour, basestring):
+            raise ValueError("colour is not a string: {0!r}".format(colour))
+    for key in ("size", "scroll", "interval", "timeout"):
+        value = spec.get(key)
+        if value is not None and (isinstance(value, bool) or
+                not isinstance(value, (int, long, float))):
+            raise ValueError("{0} is not a number: {1!r}".format(key, value))
+
+
+def element_params(params):
+    '''element params out of their JSON form'''
+    ret = dict(params)
+    for key, value in ret.items():
+        if key.startswith("colour") and isinstance(value, basestring):
+            ret[key] = ForegroundColour(value)
+    return ret
+
+
+class Config(object):
+    '''the bars of a configuration file, as (dzen2 arguments, views)'''
+    def __init__(self, path, create=registry.create):
+        self.path = path
+        self.create = create
+        self.mtime = None
+        self.elements = {}
+        self.views = {}
+        self.bars = []
+
+    def changed(self):
+        '''True if the file was modified since it was last loaded'''
+        try:
+            return os.stat(self.path).st_mtime != self.mtime
+        except OSError:
+            return False
+
+    def load(self):
+        '''read the file, building only the elements not built yet'''
+        self.mtime = os.stat(self.path).st_mtime
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            bars = [(bar.get("args", ""), list(bar["elements"]))
+                    for bar in data["bars"]]
+            for args, specs in bars:
+                if not isinstance(args, basestring):
+                    raise ValueError("args are not a string: {0!r}".format(
+                        args))
+                for spec in specs:
+                    check_spec(spec)
+        except StandardError as e:
+            raise ConfigError("{0}: {1!r}".format(self.path, e))
+        elements, views, created, stopped = {}, {}, [], []
+        try:
+            keys = set(element_key(spec) for args, specs in bars
+                    for spec in specs)
+            dropped = [elm for key, elm in self.elements.items()
+                    if key not in keys]
+            for i, (args, specs) in enumerate(bars):
+                bars[i] = (args, [self._view(spec, elements, views, created,
+                    dropped, stopped) for spec in specs])
+        except StandardError as e:
+            for elm in created:
+                elm.stop()
+            for elm in stopped:
+                elm.start()
+            raise ConfigError("{0}: {1!r}".format(self.path, e))
+        for elm in dropped:
+            if elm not in stopped:
+                elm.stop()
+        self.elements, self.views, self.bars = elements, views, bars
+
+    def _view(self, spec, elements, views, created, dropped, stopped):
+        key = element_key(spec)
+        elm = elements.get(key) or self.elements.get(key)
+        if elm is None:
+            for old in dropped:
+                if old.EXCLUSIVE and type(old).__name__ == spec["type"] \
+                        and old not in stopped:
+                    old.stop()
+                    stopped.append(old)
+            elm = self.create(spec["type"],
+                    element_params(spec.get("params", {})),
+                    interval=spec.get("interval"),
+                    timeout=spec.get("timeout"))
+            created.append(elm)
+        elements[key] = elm
+        view_key = (key, spec.get("size"), spec.get("scroll", 0),
+                spec.get("colour"))
+        view = views.get(view_key) or self.views.get(view_key)
+        if view is None:
+            colour = spec.get("colour")
+            view = View(elm, spec.get("size"), spec.get("scroll", 0),
+                    colour and ForegroundColour(colour))
+        views[view_key] = view
+        return view
+
+    def all_views(self):
+        '''the views of every bar, one after the other'''
+        return [view for args, bar in self.bars for view in bar]
+
+    def watch(self, scheduler, reloaded, interval=2):
+        '''check the file every interval seconds from the scheduler loop,
+        reconfigure scheduler and call reloaded() when it changed'''
+        def check():
+            if self.changed():
+                try:
+                    self.load()
+                except (ConfigError, OSError) as e:
+                    sys.stderr.write("config not reloaded: {0}\n".format(e))
+                else:
+                    scheduler.reconfigure(self.all_views())
+                    reloaded()
+            scheduler.at(scheduler.clock() + interval, check)
+        scheduler.at(scheduler.clock() + interval, check)
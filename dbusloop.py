@@ -0,0 +1,23 @@
+#!/usr/bin/python
+'''dbusloop module
+a single GLib main loop, run in a background thread, shared by all the
+elements that receive D-Bus method calls or signals.
+'''
+
+from thread import start_new_thread
+
+_bus = None
+
+
+def session_bus():
+    '''the session bus, dispatching its messages on the shared loop'''
+    global _bus
+    if _bus is None:
+        import dbus
+        import dbus.mainloop.glib
+        import gobject
+        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+        gobject.threads_init()
+        _bus = dbus.SessionBus()
+        start_new_thread(gobject.MainLoop().run, tuple())
+    return _bus
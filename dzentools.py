@@ -5,71 +5,464 @@ module does not mess with the OS as it cares only about syntax so it doesn't
 need any external library. 
 '''
 
+import bisect
+import collections
 import os.path
+import re
+import string
+import time
+from array import array
 
-class DzenString(str):
+_CLOSE = object()
+_UNSET = object()
+_COMMAND = re.compile(r'\^([a-z]+)\(([^)]*)\)')
+# the in-text commands understood by dzen2
+COMMANDS = frozenset(("fg", "bg", "i", "r", "ro", "c", "co", "p", "pa",
+    "ca", "ib", "tw", "cs"))
+# the ones that can't reach out of the text they are part of
+SAFE_COMMANDS = frozenset(("fg", "bg", "i", "r", "ro", "c", "co", "p", "ca"))
+
+
+class MarkupError(ValueError):
+    pass
+
+
+def _render(elm):
+    if type(elm) is tuple:
+        return "^{0}({1})".format(*elm)
+    return elm.replace("^", "^^")
+
+
+def parse_markup(text):
+    '''split dzen markup into plain text and (command, argument) tuples
+
+    the result are the elements of the DzenString rendering to text. a caret
+    not starting a known command nor escaped as ^^ raises MarkupError.
+    '''
+    ret = []
+    plain = []
+    pos = 0
+    while True:
+        i = text.find("^", pos)
+        if i < 0:
+            plain.append(text[pos:])
+            break
+        plain.append(text[pos:i])
+        if text.startswith("^^", i):
+            plain.append("^")
+            pos = i + 2
+            continue
+        match = _COMMAND.match(text, i)
+        if match is None or match.group(1) not in COMMANDS:
+            raise MarkupError("invalid markup at {0}: {1!r}".format(i,
+                text[i:i + 20]))
+        if any(plain):
+            ret.append(''.join(plain))
+        plain = []
+        ret.append(match.groups())
+        pos = match.end()
+    if any(plain):
+        ret.append(''.join(plain))
+    return ret
+
+
+def plain_text(value):
+    '''the text of a DzenString or a markup string, without the markup'''
+    if isinstance(value, DzenString):
+        elements = value.elements
+    else:
+        try:
+            elements = parse_markup(value)
+        except MarkupError:
+            return value
+    return ''.join(elm for elm in elements if type(elm) is not tuple)
+
+
+class DzenString(object):
     '''Dzen syntax aware string
 
-    this subclass of string keep tracks of syntax elements and plain text, in
-    order to avoid problems when nesting/blending many text chunks.
+    keeps track of syntax elements and plain text, in order to avoid
+    problems when nesting/blending many text chunks. a DzenString is a rope:
+    concatenating or colouring one just builds a new node pointing to its
+    parts, the dzen markup is rendered (carets escaped) only once, the
+    first time it is needed, and then cached. it behaves like the rendered
+    str when compared, hashed, sliced or asked for str methods.
     '''
-    def __new__(cls, *args):
+    __slots__ = ('parts', 'colour', '_str')
+
+    def __init__(self, *args):
         '''DzenString "costructor"
-        accept one or more plaintext string, or 2-tuples representing a dzen
-        entity. string creation is done here, as string are unmutable
+        accept one or more plaintext string, 2-tuples representing a dzen
+        entity or other DzenString
+        '''
+        self.parts = args
+        self.colour = None
+        self._str = None
+
+    @classmethod
+    def from_markup(cls, text, allowed=SAFE_COMMANDS):
+        '''DzenString out of markup coming from outside
+
+        text that isn't valid markup is taken as plain text, commands not
+        in allowed are dropped, and colours and click areas left open are
+        closed, so that the text can't change the rest of the bar.
         '''
-        str_elements = []
-        for elm in args:
-            if isinstance(elm, tuple):
-                str_elm = "^{0}({1})".format(*elm)
+        try:
+            elements = parse_markup(text)
+        except MarkupError:
+            return cls(text)
+        ret = []
+        opened = dict(fg=False, bg=False)
+        areas = 0
+        for elm in elements:
+            if type(elm) is tuple:
+                if elm[0] not in allowed:
+                    continue
+                if elm[0] in opened:
+                    opened[elm[0]] = bool(elm[1])
+                elif elm[0] == "ca":
+                    if not elm[1] and not areas:
+                        continue
+                    areas += 1 if elm[1] else -1
+            ret.append(elm)
+        ret.extend([("ca", "")] * areas)
+        ret.extend((command, "") for command in sorted(opened)
+                if opened[command])
+        return cls(*ret)
+
+    def _walk(self, rendered=False):
+        '''flattened elements, or their markup if rendered is True
+
+        a ('fg', '') inside a coloured node goes back to the colour of that
+        node instead of the default one.
+        '''
+        resets = ['']
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if item is _CLOSE:
+                resets.pop()
+                elm = ('fg', resets[-1])
+            elif isinstance(item, DzenString):
+                if rendered and item._str is not None and not resets[-1]:
+                    yield item._str
+                    continue
+                if item.colour is not None:
+                    resets.append(item.colour)
+                    stack.append(_CLOSE)
+                stack.extend(reversed(item.parts))
+                if item.colour is None:
+                    continue
+                elm = ('fg', item.colour)
+            elif item == ('fg', ''):
+                elm = ('fg', resets[-1])
             else:
-                str_elm = elm.replace("^", "^^")
-            str_elements.append(str_elm)
-        ret = str.__new__(cls, ''.join(str_elements))
-        ret.elements = args
-        return ret
+                elm = item
+            yield _render(elm) if rendered else elm
+
+    @property
+    def elements(self):
+        return tuple(self._walk())
+
+    def __str__(self):
+        if self._str is None:
+            self._str = ''.join(self._walk(rendered=True))
+        return self._str
+
+    def __repr__(self):
+        return "DzenString({0!r})".format(str(self))
 
     def __add__(self, other):
-        if isinstance(other, DzenString):
-            ret = self.elements + other.elements
-        else:
-            ret = self.elements + (other,)
-        return DzenString(*ret)
+        return DzenString(self, other)
 
     def __radd__(self, other):
-        if isinstance(other, DzenString):
-            ret = other.elements + self.elements
-        else:
-            ret = (other,) + self.elements
-        return DzenString(*ret)
+        return DzenString(other, self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (DzenString, basestring)):
+            return NotImplemented
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        return ret if ret is NotImplemented else not ret
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __len__(self):
+        return len(str(self))
+
+    def __getitem__(self, key):
+        return str(self)[key]
+
+    def __contains__(self, item):
+        return item in str(self)
+
+    def __getattr__(self, name):
+        return getattr(str(self), name)
 
 
 class ForegroundColour(object):
     def __init__(self, colour):
         self.colour = colour
+        self._last = (None, None)
 
     def __call__(self, my_string):
-        if hasattr(my_string, "elements"):
-            ret = [('fg', str(self.colour))]
-            for elm in my_string.elements:
-                if elm == ('fg', ''):
-                    ret.append(('fg', str(self.colour)))
-                else:
-                    ret.append(elm)
-            ret.append(('fg', ''))
-            ret = tuple(ret)
+        colour = str(self.colour)
+        last_string, ret = self._last
+        if ret is not None and my_string is last_string \
+                and ret.colour == colour:
+            return ret
+        ret = DzenString(my_string)
+        ret.colour = colour
+        self._last = (my_string, ret)
+        return ret
+
+
+class Template(object):
+    '''element output declared as a format string with static decorations
+
+    icon, colour and the literal parts of fmt are rendered to markup once.
+    on every call only the fields whose value changed are formatted again,
+    and if none did the very same str of the previous call is returned.
+    '''
+    _formatter = string.Formatter()
+
+    def __init__(self, fmt, icon=None, colour=None):
+        self.literals = []
+        self.fields = []
+        for literal, field, spec, conversion in self._formatter.parse(fmt):
+            self.literals.append(literal.replace("^", "^^"))
+            if field is not None:
+                self.fields.append((field, spec, conversion))
+        if len(self.literals) == len(self.fields):
+            self.literals.append('')
+        prefix = str(icon) if icon is not None else ''
+        suffix = ''
+        if colour is not None:
+            prefix = "^fg(" + str(colour.colour) + ")" + prefix
+            suffix = "^fg()"
+        self.literals[0] = prefix + self.literals[0]
+        self.literals[-1] += suffix
+        self._values = [_UNSET] * len(self.fields)
+        self._texts = [''] * len(self.fields)
+        self._last = None
+
+    def __call__(self, *args, **kwargs):
+        changed = self._last is None
+        auto = 0
+        for i, (field, spec, conversion) in enumerate(self.fields):
+            if field == '':
+                field, auto = str(auto), auto + 1
+            value = self._formatter.get_field(field, args, kwargs)[0]
+            old = self._values[i]
+            if type(value) is type(old) and value == old:
+                continue
+            self._values[i] = value
+            value = self._formatter.convert_field(value, conversion)
+            self._texts[i] = format(value, spec).replace("^", "^^")
+            changed = True
+        if changed:
+            ret = [self.literals[0]]
+            for text, literal in zip(self._texts, self.literals[1:]):
+                ret.append(text)
+                ret.append(literal)
+            self._last = ''.join(ret)
+        return self._last
+
+
+class History(object):
+    '''fixed size ring buffer of numbers, backed by an array'''
+    def __init__(self, size, typecode='d'):
+        self.data = array(typecode, [0]) * size
+        self.pos = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        '''values from the oldest to the newest'''
+        size = len(self.data)
+        for i in range(self.pos - self.count, self.pos):
+            yield self.data[i % size]
+
+
+class Graph(object):
+    '''dzen bar graph of the last `width` values pushed
+
+    every column is a ^r rectangle, moved down with ^p so that bars stand on
+    the same baseline. the markup of each possible column height is built
+    once and the graph keeps the markup of the columns already drawn, so a
+    push only appends one column, and joins the `width` column strings
+    into the returned markup. values are scaled on [low, high]; with
+    high=None the scale follows the highest value in the history (and the
+    columns are redrawn when it changes). that maximum is kept up to date
+    with a deque of the values not smaller than any later one, instead of
+    scanning the whole history on every push.
+    '''
+    def __init__(self, width, height=10, low=0.0, high=None):
+        self.height = height
+        self.low = low
+        self.high = high
+        self.history = History(width)
+        self._scale = high
+        # (push number, value) of the candidates for the maximum, the
+        # values decreasing from the left
+        self._maxima = collections.deque()
+        self._pushes = 0
+        self._markup = ["^p(1)"] + ["^p(;{0})^r(1x{1})".format(
+            (height - h + 1) // 2, h) for h in range(1, height + 1)]
+        self.columns = collections.deque([self._markup[0]] * width,
+                maxlen=width)
+
+    def _column(self, value):
+        scale = self._scale - self.low
+        if scale <= 0:
+            return self._markup[0]
+        level = int(round((value - self.low) / scale * self.height))
+        return self._markup[max(0, min(level, self.height))]
+
+    def push(self, value):
+        '''add a value, return the markup of the whole graph'''
+        self.history.append(value)
+        if self.high is None:
+            history, maxima = self.history, self._maxima
+            self._pushes += 1
+            while maxima and maxima[-1][1] <= value:
+                maxima.pop()
+            maxima.append((self._pushes, value))
+            if maxima[0][0] <= self._pushes - len(history.data):
+                maxima.popleft()
+            scale = maxima[0][1]
+            if scale != self._scale:
+                self._scale = scale
+                columns = self.columns
+                columns.extend([self._markup[0]]
+                        * (columns.maxlen - len(history)))
+                columns.extend(self._column(v) for v in history)
+                return ''.join(self.columns) + "^p()"
+        self.columns.append(self._column(value))
+        return ''.join(self.columns) + "^p()"
+
+
+class ElementStats(object):
+    '''counters and update() latency histogram of a BarElement'''
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self):
+        self.calls = self.skips = self.errors = self.stale = 0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        self.total = self.max = 0.0
+        self.last_success = self.last_error = None
+
+    def record(self, latency, error=None):
+        '''account an update() call that took latency seconds'''
+        self.calls += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.histogram[bisect.bisect_right(self.BUCKETS, latency)] += 1
+        if error is None:
+            self.last_success = time.time()
         else:
-            ret = (("fg", str(self.colour)), my_string, ("fg", ""))
-        return DzenString(*ret)
+            self.errors += 1
+            self.last_error = error
 
+    def __str__(self):
+        mean = self.total / self.calls if self.calls else 0.0
+        if self.last_success is None:
+            success = "never"
+        else:
+            success = time.strftime("%H:%M:%S",
+                    time.localtime(self.last_success))
+        hist = " ".join("<{0:g}ms:{1}".format(bound * 1000, count)
+                for bound, count in zip(self.BUCKETS, self.histogram) if count)
+        if self.histogram[-1]:
+            hist += " >={0:g}ms:{1}".format(self.BUCKETS[-1] * 1000,
+                    self.histogram[-1])
+        ret = ("calls={0.calls} skips={0.skips} errors={0.errors} "
+               "stale={0.stale} mean={1:.2f}ms max={2:.2f}ms "
+               "last_success={3} [{4}]").format(self, mean * 1000,
+                       self.max * 1000, success, hist)
+        if self.last_error is not None:
+            ret += " last_error=" + self.last_error
+        return ret
 
-class BarElement(object):
-    DEFAULT_PARAMS = {}
-    def __init__(self, params={}, size=None, scroll=0):
+
+class View(object):
+    '''an element as shown on one bar: its width, scrolling and colour
+
+    the same element can be shown by several views, e.g. on different bars,
+    each rendering the value the element sampled once. the rendered string
+    is kept and returned again while the value doesn't change.
+    '''
+    def __init__(self, element, size=None, scroll=0, colour=None):
+        self.element = element
         self.size = size
         self.scroll = scroll
+        self.colour = colour
         self.scroll_cursor = 0
+        self.value = None
+        self.rendered = None
+
+    def render(self, ret, stale=False):
+        if (self.rendered is not None and not self.scroll
+                and not stale and ret == self.value):
+            return self.rendered
+        self.value = ret
+        if isinstance(ret, DzenString):
+            ret = str(ret)
+        if self.size is None:
+            pass
+        elif len(ret) < self.size:
+            ret = ret.rjust(self.size)
+        elif len(ret) >= self.size:
+            ret += ' | '
+        if self.scroll:
+            self.scroll_cursor %= len(ret)
+            ret = ret[self.scroll_cursor:] + ret[:self.scroll_cursor]
+            self.scroll_cursor += self.scroll
+        ret = ret[:self.size]
+        col = self.colour or self.element.params.get('colour')
+        if stale:
+            ret = "^fg(" + self.element.STALE_COLOUR + ")" + ret + "^fg()"
+            self.value = None
+        elif col:
+            ret = "^fg(" + col.colour +")" + ret +"^fg()" #XXX 
+        if type(ret) == unicode:
+            ret = ret.encode('utf-8', 'replace')
+        self.rendered = ret
+        return ret
+
+    def next(self):
+        return self.render(self.element.sample(), self.element.stale)
+
+
+class BarElement(object):
+    DEFAULT_PARAMS = {}
+    INTERVAL = 1
+    TIMEOUT = 0.1
+    STALE_COLOUR = "darkgrey"
+    # True when two elements of the class can't be started together (a bus
+    # name...): on reload the old one is then stopped before the new one
+    EXCLUSIVE = False
+    pool = None
+    def __init__(self, params={}, size=None, scroll=0, interval=None,
+            timeout=None):
+        self.view = View(self, size, scroll)
+        self.interval = interval or self.INTERVAL
+        self.timeout = timeout or self.TIMEOUT
         self.last = None
+        self.stale = False
+        self.job = None
+        self.submitted = False
+        self.stats = ElementStats()
         self.params = {}
         self.params.update(self.DEFAULT_PARAMS)
         self.params.update(params)
@@ -78,56 +471,130 @@ class BarElement(object):
     def start(self):
         pass
 
+    def stop(self):
+        '''release what start() acquired, the element is no longer shown'''
+        pass
+
     def update(self):
         pass
 
     def check_update(self):
         return True
 
-    def next(self):
-        if self.last and not self.check_update():
+    def wakeup_fds(self):
+        '''file descriptors that, when readable, make the element due now'''
+        return []
+
+    def handle_wakeup(self, fd):
+        '''called when fd is readable, before the element is updated'''
+        pass
+
+    def _update(self):
+        start = time.time()
+        try:
+            ret = self.update()
+        except Exception as e:
+            ret = repr(e)
+            self.stats.record(time.time() - start, ret)
+        else:
+            self.stats.record(time.time() - start)
+        return ret
+
+    def submit(self):
+        '''start update() on the pool, if due and not already running'''
+        self.submitted = True
+        if self.job is None and (not self.last or self.check_update()):
+            self.job = self.pool.submit(self._update)
+            self.deadline = time.time() + self.timeout
+
+    def collect(self):
+        '''result of the running update, or the last one if past deadline'''
+        if not self.submitted:
+            self.submit()
+        self.submitted = False
+        if self.job is None:
+            self.stats.skips += 1
+            return self.last
+        if self.job.wait(self.deadline - time.time()):
+            ret, self.job = self.job.result, None
+            self.stale = False
+        else:
+            ret = self.last or " "
+            self.stale = True
+            self.stats.stale += 1
+        return ret
+
+    def sample(self):
+        '''the raw value of the element, updated if needed'''
+        if self.pool is not None:
+            ret = self.collect()
+        elif self.last and not self.check_update():
+            self.stats.skips += 1
             ret = self.last
         else:
-            try:
-                ret = self.update()
-            except StandardError as e:
-                ret = repr(e)
+            ret = self._update()
         if not ret:
             raise StopIteration
         self.last = ret
-        if self.size is None:
-            pass
-        elif len(ret) < self.size:
-            ret = ret.rjust(self.size)
-        elif len(ret) >= self.size:
-            ret += ' | '
-        if self.scroll:
-            self.scroll_cursor %= len(ret)
-            ret = ret[self.scroll_cursor:] + ret[:self.scroll_cursor]
-            self.scroll_cursor += self.scroll
-        ret = ret[:self.size]
-        col = self.params.get('colour')
-        if col:
-            ret = "^fg(" + col.colour +")" + ret +"^fg()" #XXX 
-        if type(ret) == unicode:
-            ret = ret.encode('utf-8', 'replace')
         return ret
 
+    def next(self):
+        return self.view.render(self.sample(), self.stale)
+
     def __iter__(self):
         return self
 
 
 class Icon(object):
-    def __init__(self, base_dir):
+    '''registry of the icons found in a directory
+
+    every icon is looked up and rendered once, then served from memory. the
+    directory mtime is checked at most every `recheck` seconds, and only if
+    it changed (icons added, removed or replaced) the cache is dropped.
+    '''
+    def __init__(self, base_dir, recheck=5):
         self.base_dir = os.path.abspath(base_dir)
         if not os.access(base_dir, os.R_OK):
             raise IOError("cannot access '{0.base_dir}' directory".format(self))
+        self.recheck = recheck
+        self._icons = {}
+        self._mtime = os.stat(self.base_dir).st_mtime
+        self._checked = time.time()
+
+    def _check_dir(self):
+        now = time.time()
+        if now - self._checked < self.recheck:
+            return
+        self._checked = now
+        mtime = os.stat(self.base_dir).st_mtime
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._icons.clear()
 
     def get_icon(self, icon_name):
+        self._check_dir()
+        try:
+            return self._icons[icon_name]
+        except KeyError:
+            pass
         ipath = os.path.join(self.base_dir, icon_name)
         if not os.access(ipath, os.R_OK):
             raise IOError("cannot access icon")
-        return DzenString(('i', ipath))
+        icon = DzenString(('i', ipath))
+        str(icon) # render the markup now, once
+        self._icons[icon_name] = icon
+        return icon
+
+    def validate(self, *icon_names):
+        '''load all the given icons, raise IOError naming the missing ones'''
+        missing = []
+        for name in icon_names:
+            try:
+                self.get_icon(name)
+            except IOError:
+                missing.append(name)
+        if missing:
+            raise IOError("cannot access icons: " + ", ".join(missing))
 
     def __getitem__(self, name):
         return self.get_icon(name)
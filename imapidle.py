@@ -0,0 +1,190 @@
+#!/usr/bin/python
+'''imapidle module
+minimal IMAP4rev1 client keeping the count of unseen messages of a mailbox
+up to date with IDLE (RFC 2177): the connection stays logged in and the
+server tells when the mailbox changes, instead of the bar logging in again
+and searching it at every check.
+'''
+
+import itertools
+import select
+import socket
+
+from scheduler import ReconnectingWatcher
+
+
+class ImapError(Exception):
+    pass
+
+
+def quote(arg):
+    '''arg as an IMAP quoted string'''
+    return '"' + arg.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class ImapConnection(object):
+    '''an authenticated connection speaking the IMAP line protocol'''
+    def __init__(self, host, port=993, user=None, password=None,
+            use_ssl=True, timeout=30):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.buffer = ''
+        self.tags = itertools.count(1)
+        try:
+            self._login(host, user, password, use_ssl, timeout)
+        except Exception:
+            # the caller gets no object to close, every retry would leak
+            self.sock.close()
+            raise
+
+    def _login(self, host, user, password, use_ssl, timeout):
+        if use_ssl:
+            import ssl
+            self.sock = ssl.create_default_context().wrap_socket(self.sock,
+                    server_hostname=host)
+        self.sock.settimeout(timeout)
+        greeting = self.readline()
+        if not greeting.startswith(("* OK", "* PREAUTH")):
+            raise ImapError("not an IMAP server: {0!r}".format(greeting))
+        if user is not None and not greeting.startswith("* PREAUTH"):
+            self.command("LOGIN", quote(user), quote(password or ''))
+        self.capabilities = set()
+        for line in self.command("CAPABILITY"):
+            if line.startswith("CAPABILITY "):
+                self.capabilities.update(line.split()[1:])
+
+    def readline(self, timeout=None):
+        '''next line from the server, None if timeout expires first'''
+        while "\n" not in self.buffer:
+            pending = getattr(self.sock, 'pending', lambda: 0)()
+            if timeout is not None and not pending and \
+                    not select.select([self.sock], [], [], timeout)[0]:
+                return None
+            data = self.sock.recv(4096)
+            if not data:
+                raise ImapError("connection closed")
+            self.buffer += data
+        line, self.buffer = self.buffer.split("\n", 1)
+        return line.rstrip("\r")
+
+    def _send(self, *args):
+        tag = "a{0}".format(next(self.tags))
+        self.sock.sendall(" ".join((tag,) + args) + "\r\n")
+        return tag
+
+    def _complete(self, tag):
+        '''untagged responses until the completion of tag'''
+        ret = []
+        while True:
+            line = self.readline()
+            if line.startswith(tag + " "):
+                if not line[len(tag) + 1:].startswith("OK"):
+                    raise ImapError(line)
+                return ret
+            if line.startswith("* "):
+                ret.append(line[2:])
+
+    def command(self, *args):
+        '''send a command, return its untagged responses'''
+        return self._complete(self._send(*args))
+
+    def unseen(self):
+        '''number of unseen messages in the selected mailbox'''
+        for line in self.command("SEARCH", "UNSEEN"):
+            if line.startswith("SEARCH"):
+                return len(line.split()) - 1
+        return 0
+
+    def idle(self, timeout):
+        '''wait up to timeout for the mailbox to change, True if it did'''
+        tag = self._send("IDLE")
+        line = self.readline()
+        if not line.startswith("+"):
+            raise ImapError(line)
+        changed = self.readline(timeout) is not None
+        self.sock.sendall("DONE\r\n")
+        self._complete(tag)
+        return changed
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class ImapWatcher(ReconnectingWatcher):
+    '''keeps the number of unseen messages of a mailbox up to date
+
+    the connection waits in IDLE, re-issuing it every `renew` seconds as
+    the RFC asks; servers without IDLE are searched every `poll` seconds
+    instead. see ReconnectingWatcher for the reconnections. every listener
+    is called (from the thread of the watcher) when unseen or error change.
+    '''
+    errors = (socket.error, ImapError)
+    _shared = {}
+
+    def __init__(self, host, port=993, user=None, password=None,
+            mailbox="INBOX", use_ssl=True, backoff=(1, 300), poll=600,
+            renew=29 * 60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.use_ssl = use_ssl
+        self.poll = poll
+        self.renew = renew
+        self.listeners = []
+        self.unseen = None
+        self.error = None
+        ReconnectingWatcher.__init__(self, backoff)
+
+    @classmethod
+    def shared(cls, listener, **account):
+        '''the watcher of an account, shared by all the elements showing it'''
+        key = tuple(sorted(account.items()))
+        watcher = cls._shared.get(key)
+        if watcher is None:
+            watcher = cls._shared[key] = cls(**account)
+        watcher.listeners.append(listener)
+        return watcher
+
+    def release(self, listener):
+        '''remove a listener, the watcher stops with the last one'''
+        self.listeners.remove(listener)
+        if not self.listeners:
+            for key, watcher in self._shared.items():
+                if watcher is self:
+                    del self._shared[key]
+            self.stop()
+
+    def _changed(self):
+        for listener in list(self.listeners):
+            listener()
+
+    def connect(self):
+        conn = ImapConnection(self.host, self.port, self.user,
+                self.password, self.use_ssl)
+        try:
+            conn.command("EXAMINE", quote(self.mailbox))
+        except self.errors:
+            conn.close()
+            raise
+        return conn
+
+    def watch(self, conn):
+        while not self._stop.is_set():
+            unseen = conn.unseen()
+            if unseen != self.unseen or self.error is not None:
+                self.unseen, self.error = unseen, None
+                self._changed()
+            if "IDLE" in conn.capabilities:
+                conn.idle(self.renew)
+            else:
+                self._stop.wait(self.poll)
+
+    def lost(self, error):
+        self.unseen = None
+        self.error = error
+        self._changed()
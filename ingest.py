@@ -0,0 +1,156 @@
+#!/usr/bin/python
+'''ingest module
+element showing lines written by other programs to a named pipe or a Unix
+socket, so that a shell script can feed the bar whenever it has something
+new instead of being forked at every tick:
+
+    echo "mail	^fg(red)3 new" > ~/.statusbar.fifo
+
+a line is "producer<TAB>text" or just "text" (producer ""). only the latest
+text of every producer is kept, an empty one removes the producer. texts are
+shown in the order their producers appeared.
+'''
+
+import collections
+import errno
+import os
+import socket
+import stat
+import threading
+
+from dzentools import BarElement, DzenString
+from scheduler import PushMixin
+
+
+class Ingest(PushMixin, BarElement):
+    '''latest lines of the producers writing to `fifo` and/or `socket`
+
+    both are created if missing. the descriptors are read without blocking
+    as soon as they are readable, so a new line is shown right away. the
+    markup of the lines is checked and escaped (see DzenString.from_markup)
+    and lines longer than `max_line` bytes are cut.
+    '''
+    DEFAULT_PARAMS = dict(fifo=None, socket=None, separator=" ",
+            max_line=1024, empty=" ")
+    INTERVAL = 60
+
+    def start(self):
+        super(Ingest, self).start()
+        self.producers = collections.OrderedDict()
+        # add() runs in the scheduler loop, update() on a pool thread
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._clients = {}
+        self._fifo = self._listener = None
+        if self.params['fifo']:
+            path = os.path.expanduser(self.params['fifo'])
+            if not os.path.exists(path):
+                os.mkfifo(path, 0600)
+            elif not stat.S_ISFIFO(os.stat(path).st_mode):
+                raise IOError("{0} is not a named pipe".format(path))
+            self._fifo = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            # a writer of our own keeps the pipe from reporting EOF (and
+            # staying readable) every time the last producer closes it
+            self._fifo_writer = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            self._buffers[self._fifo] = ''
+        if self.params['socket']:
+            path = os.path.expanduser(self.params['socket'])
+            if os.path.exists(path) and \
+                    stat.S_ISSOCK(os.stat(path).st_mode):
+                os.remove(path)
+            self._listener = socket.socket(socket.AF_UNIX)
+            self._listener.setblocking(False)
+            self._listener.bind(path)
+            self._listener.listen(5)
+            self._inode = os.stat(path).st_ino
+
+    def stop(self):
+        for sock in self._clients.values():
+            sock.close()
+        self._clients = {}
+        if self._fifo is not None:
+            os.close(self._fifo)
+            os.close(self._fifo_writer)
+            self._fifo = None
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            # after a reload the path may already be the socket of the
+            # element replacing this one
+            path = os.path.expanduser(self.params['socket'])
+            try:
+                if os.stat(path).st_ino == self._inode:
+                    os.remove(path)
+            except OSError:
+                pass
+        super(Ingest, self).stop()
+
+    def wakeup_fds(self):
+        ret = list(self._clients)
+        if self._fifo is not None:
+            ret.append(self._fifo)
+        if self._listener is not None:
+            ret.append(self._listener.fileno())
+        return ret
+
+    def handle_wakeup(self, fd):
+        if self._listener is not None and fd == self._listener.fileno():
+            self._accept()
+        elif fd == self._fifo:
+            self._read(fd, lambda: os.read(fd, 4096))
+        elif fd in self._clients:
+            if not self._read(fd, lambda: self._clients[fd].recv(4096)):
+                self._clients.pop(fd).close()
+                rest = self._buffers.pop(fd)
+                if rest:
+                    self.add(rest)
+
+    def _accept(self):
+        while True:
+            try:
+                sock = self._listener.accept()[0]
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(False)
+            self._clients[sock.fileno()] = sock
+            self._buffers[sock.fileno()] = ''
+
+    def _read(self, fd, read):
+        '''read what is available on fd, False when it is closed'''
+        while True:
+            try:
+                data = read()
+            except (OSError, socket.error) as e:
+                return e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+            if not data:
+                return False
+            lines = (self._buffers[fd] + data).split("\n")
+            self._buffers[fd] = lines.pop()[:self.params['max_line']]
+            for line in lines:
+                self.add(line[:self.params['max_line']])
+
+    def add(self, line):
+        '''take the text of a line, replacing the one of its producer'''
+        producer, sep, text = line.rstrip("\r").partition("\t")
+        if not sep:
+            producer, text = "", producer
+        with self._lock:
+            if text:
+                self.producers[producer] = DzenString.from_markup(text)
+            else:
+                self.producers.pop(producer, None)
+        self._pushed = True
+
+    def update(self):
+        with self._lock:
+            texts = self.producers.values()
+        if not texts:
+            return self.params['empty']
+        ret = []
+        for text in texts:
+            if ret:
+                ret.append(self.params['separator'])
+            ret.append(text)
+        return DzenString(*ret)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+'''mpdidle module
+minimal client for the MPD text protocol that follows the current song
+with the "idle player" command, so the bar learns about song changes as
+they happen instead of polling the server every tick.
+'''
+
+import socket
+
+from scheduler import ReconnectingWatcher
+
+# seconds idle before the first probe, seconds between probes, and probes
+# unanswered before the connection is dropped
+KEEPALIVE = (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3))
+
+
+class MpdError(Exception):
+    pass
+
+
+class MpdConnection(object):
+    '''a connection speaking the MPD line protocol'''
+    def __init__(self, host="localhost", port=6600, password=None,
+            timeout=10):
+        self.sock = socket.create_connection((host, port), timeout)
+        # idle blocks until something changes, no read timeout from now on:
+        # the kernel probes the server instead, so that a connection left
+        # half open (server rebooted, network gone) still ends in an error
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in KEEPALIVE:
+            if hasattr(socket, option):
+                self.sock.setsockopt(socket.IPPROTO_TCP,
+                        getattr(socket, option), value)
+        self.file = self.sock.makefile('rb')
+        try:
+            banner = self.file.readline()
+            if not banner.startswith("OK MPD "):
+                raise MpdError("not an MPD server: {0!r}".format(banner))
+            if password is not None:
+                self.command("password", password)
+        except Exception:
+            self.sock.close()
+            raise
+
+    def command(self, *args):
+        '''send a command, return its response as a list of (key, value)'''
+        line = " ".join(args[:1] + tuple('"{0}"'.format(
+                arg.replace("\\", "\\\\").replace('"', '\\"'))
+                for arg in args[1:]))
+        self.sock.sendall(line + "\n")
+        ret = []
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise MpdError("connection closed")
+            line = line.rstrip("\n")
+            if line == "OK":
+                return ret
+            if line.startswith("ACK "):
+                raise MpdError(line)
+            key, sep, value = line.partition(": ")
+            ret.append((key, value))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class MpdWatcher(ReconnectingWatcher):
+    '''keeps the current song of an MPD server up to date
+
+    the connection asks for the current song and then waits in "idle
+    player", see ReconnectingWatcher. changed is called (from the thread of
+    the watcher) every time song or error change.
+    '''
+    errors = (socket.error, MpdError)
+
+    def __init__(self, host="localhost", port=6600, password=None,
+            changed=None, backoff=(1, 60)):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.changed = changed or (lambda: None)
+        self.song = None
+        self.error = None
+        ReconnectingWatcher.__init__(self, backoff)
+
+    def connect(self):
+        return MpdConnection(self.host, self.port, self.password)
+
+    def watch(self, conn):
+        while not self._stop.is_set():
+            self.song = dict(conn.command("currentsong"))
+            self.error = None
+            self.changed()
+            conn.command("idle", "player")
+
+    def lost(self, error):
+        self.song = None
+        self.error = error
+        self.changed()
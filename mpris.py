@@ -0,0 +1,102 @@
+#!/usr/bin/python
+'''mpris module
+MPRIS2 now playing element. players are discovered through NameOwnerChanged
+and their metadata arrives with PropertiesChanged signals, so once a player
+is known showing its song costs no D-Bus round trip at all.
+'''
+
+from dzentools import BarElement
+from scheduler import PushMixin
+from dbusloop import session_bus
+
+PREFIX = "org.mpris.MediaPlayer2."
+PATH = "/org/mpris/MediaPlayer2"
+PLAYER_IFACE = "org.mpris.MediaPlayer2.Player"
+PROPS_IFACE = "org.freedesktop.DBus.Properties"
+
+
+def format_metadata(metadata):
+    '''"artist - title" out of an MPRIS2 metadata dict'''
+    title = metadata.get("xesam:title") or metadata.get("xesam:url", "")
+    artist = metadata.get("xesam:artist") or []
+    if isinstance(artist, basestring):
+        artist = [artist]
+    artist = u", ".join(unicode(a) for a in artist)
+    return u" - ".join(unicode(x) for x in (artist, title) if x)
+
+
+class Mpris2Player(PushMixin, BarElement):
+    '''song of the MPRIS2 player currently playing
+
+    `player` selects one application (e.g. "vlc" for org.mpris.MediaPlayer2.vlc)
+    otherwise the first playing player is shown.
+    '''
+    DEFAULT_PARAMS = dict(player=None, bus=None)
+
+    def start(self):
+        super(Mpris2Player, self).start()
+        self.bus = self.params['bus'] or session_bus()
+        self.players = {}
+        self.owners = {}
+        self.receivers = [
+            self.bus.add_signal_receiver(self._name_owner_changed,
+                "NameOwnerChanged", "org.freedesktop.DBus",
+                "org.freedesktop.DBus", "/org/freedesktop/DBus"),
+            self.bus.add_signal_receiver(self._properties_changed,
+                "PropertiesChanged", PROPS_IFACE, path=PATH,
+                sender_keyword="sender")]
+        for name in self.bus.list_names():
+            if name.startswith(PREFIX):
+                self._add_player(name, self.bus.get_name_owner(name))
+
+    def stop(self):
+        for receiver in self.receivers:
+            receiver.remove()
+        self.receivers = []
+        super(Mpris2Player, self).stop()
+
+    def _add_player(self, name, owner):
+        self.owners[owner] = name
+        self.players[name] = {}
+        proxy = self.bus.get_object(name, PATH)
+        proxy.GetAll(PLAYER_IFACE, dbus_interface=PROPS_IFACE,
+                reply_handler=lambda props: self._update_player(name, props),
+                error_handler=lambda error: None)
+
+    def _update_player(self, name, props):
+        if name not in self.players:
+            return
+        player = dict(self.players[name])
+        if "Metadata" in props:
+            player["song"] = format_metadata(props["Metadata"])
+        if "PlaybackStatus" in props:
+            player["status"] = unicode(props["PlaybackStatus"])
+        self.players[name] = player
+        self.push()
+
+    def _name_owner_changed(self, name, old_owner, new_owner):
+        if not name.startswith(PREFIX):
+            return
+        self.owners.pop(old_owner, None)
+        if new_owner:
+            self._add_player(name, new_owner)
+        else:
+            self.players.pop(name, None)
+            self.push()
+
+    def _properties_changed(self, interface, changed, invalidated,
+            sender=None):
+        if interface == PLAYER_IFACE and sender in self.owners:
+            self._update_player(self.owners[sender], changed)
+
+    def update(self):
+        players = self.players
+        if self.params['player']:
+            player = players.get(PREFIX + self.params['player'], {})
+        else:
+            playing = [p for p in players.values()
+                    if p.get("status") == "Playing"]
+            player = playing[0] if playing else {}
+        if player.get("status", "Stopped") == "Stopped":
+            return "Not Playing"
+        return player.get("song") or "No title"
@@ -2,90 +2,215 @@
 '''notifications from dzen bar module
 notification-daemon derived from 
 http://github.com/halhen/statnot
+dbus and gobject are imported only when a Notification is started.
 '''
-from thread import start_new_thread
+import bisect
+import collections
+import time
 import Queue
-import dbus
-import dbus.service
-import dbus.mainloop.glib
-import gobject
 from dzentools import BarElement
 from basicelements import RED
+from scheduler import PushMixin
+from dbusloop import session_bus
 
 
-class NotificationFetcher(dbus.service.Object):
-    _id = 0
-    queue = None
-
-    @dbus.service.method("org.freedesktop.Notifications",
-                         in_signature='susssasa{ss}i',
-                         out_signature='u')
-    def Notify(self, app_name, notification_id, app_icon,
-               summary, body, actions, hints, expire_timeout):
-
-        if not notification_id:
-            self._id += 1
-            notification_id = self._id
-			
-        text = ("%s %s" % (summary, body)).strip()
-        self.queue.put(text)
-        return notification_id
-		
-    @dbus.service.method("org.freedesktop.Notifications", in_signature='', out_signature='as')
-    def GetCapabilities(self):
-        return ("body")
-	
-    @dbus.service.signal('org.freedesktop.Notifications', signature='uu')
-    def NotificationClosed(self, id_in, reason_in):
-        pass
-
-    @dbus.service.method("org.freedesktop.Notifications", in_signature='u', out_signature='')
-    def CloseNotification(self, id):
-        pass
-
-    @dbus.service.method("org.freedesktop.Notifications", in_signature='', out_signature='ssss')
-    def GetServerInformation(self):
-        return ("statnot-like", "http://github.com/0Chuzz/dzentools", "0.0.1", "1")
-
-
-class Notification(BarElement):
+# NotificationClosed reasons
+EXPIRED, DISMISSED, CLOSED, UNDEFINED = 1, 2, 3, 4
+# urgency hint values
+LOW, NORMAL, CRITICAL = 0, 1, 2
+
+
+class NotificationStore(object):
+    '''bounded set of the notifications being shown, keyed by id
+
+    notifications are rotated most urgent first, oldest first. a new one
+    evicts the least urgent, oldest notification when the store is full;
+    one with a known id replaces it in place. an app can't add more than
+    `rate` = (count, seconds) new notifications in a period. `closed` is
+    called as closed(id, reason) for every notification leaving the store.
+    '''
+    def __init__(self, size=20, default_timeout=10, rate=(5, 60),
+            closed=None, clock=time.time):
+        self.size = size
+        self.default_timeout = default_timeout
+        self.rate = rate
+        self.closed = closed or (lambda notification_id, reason: None)
+        self.clock = clock
+        self.items = {}
+        self.order = []
+        self._seq = 0
+        self._sent = collections.defaultdict(collections.deque)
+        self._shown = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def _allowed(self, app_name, now):
+        count, period = self.rate
+        sent = self._sent[app_name]
+        while sent and sent[0] <= now - period:
+            sent.popleft()
+        if len(sent) >= count:
+            return False
+        sent.append(now)
+        return True
+
+    def add(self, notification_id, text, app_name='', urgency=NORMAL,
+            expire_timeout=-1):
+        '''show a notification, return False if it was rate limited'''
+        now = self.clock()
+        if expire_timeout < 0:
+            expire_timeout = self.default_timeout * 1000
+        if expire_timeout == 0 or urgency >= CRITICAL:
+            expires = None
+        else:
+            expires = now + expire_timeout / 1000.0
+        old = self.items.get(notification_id)
+        if old is not None:
+            self._remove(notification_id)
+            key = (-urgency, old[0][1], notification_id)
+        else:
+            if not self._allowed(app_name, now):
+                return False
+            if len(self.items) >= self.size:
+                least = bisect.bisect_left(self.order, (self.order[-1][0],))
+                self.close(self.order[least][2], UNDEFINED)
+            self._seq += 1
+            key = (-urgency, self._seq, notification_id)
+        self.items[notification_id] = (key, text, expires)
+        bisect.insort(self.order, key)
+        return True
+
+    def _remove(self, notification_id):
+        key = self.items.pop(notification_id)[0]
+        del self.order[bisect.bisect_left(self.order, key)]
+
+    def close(self, notification_id, reason=CLOSED):
+        if notification_id in self.items:
+            self._remove(notification_id)
+            self.closed(notification_id, reason)
+
+    def clear(self):
+        for key in list(self.order):
+            self.close(key[2], DISMISSED)
+
+    def expire(self):
+        now = self.clock()
+        for notification_id, (key, text, expires) in self.items.items():
+            if expires is not None and expires <= now:
+                self.close(notification_id, EXPIRED)
+
+    def next(self):
+        '''text of the next notification to show, None if there's none'''
+        if not self.order:
+            return None
+        pos = 0
+        if self._shown is not None:
+            pos = bisect.bisect_right(self.order, self._shown)
+            if pos == len(self.order):
+                pos = 0
+        self._shown = self.order[pos]
+        return self.items[self._shown[2]][1]
+
+
+def fetcher_class():
+    '''the dbus.service.Object class serving org.freedesktop.Notifications'''
+    import dbus.service
+
+    class NotificationFetcher(dbus.service.Object):
+        _id = 0
+        queue = None
+        wakeup = None
+
+        @dbus.service.method("org.freedesktop.Notifications",
+                             in_signature='susssasa{sv}i',
+                             out_signature='u')
+        def Notify(self, app_name, notification_id, app_icon,
+                   summary, body, actions, hints, expire_timeout):
+
+            if not notification_id:
+                self._id += 1
+                notification_id = self._id
+
+            text = ("%s %s" % (summary, body)).strip()
+            self.queue.put(("notify", notification_id, text, app_name,
+                int(hints.get("urgency", NORMAL)), expire_timeout))
+            self.wakeup.set()
+            return notification_id
+
+        @dbus.service.method("org.freedesktop.Notifications", in_signature='', out_signature='as')
+        def GetCapabilities(self):
+            return ("body")
+
+        @dbus.service.signal('org.freedesktop.Notifications', signature='uu')
+        def NotificationClosed(self, id_in, reason_in):
+            pass
+
+        @dbus.service.method("org.freedesktop.Notifications", in_signature='u', out_signature='')
+        def CloseNotification(self, id):
+            self.queue.put(("close", id))
+            self.wakeup.set()
+
+        @dbus.service.method("org.freedesktop.Notifications", in_signature='', out_signature='ssss')
+        def GetServerInformation(self):
+            return ("statnot-like", "http://github.com/0Chuzz/dzentools", "0.0.1", "1")
+
+    return NotificationFetcher
+
+
+class Notification(PushMixin, BarElement):
+    EXCLUSIVE = True
     DEFAULT_PARAMS = dict(
-            colour=RED)
+            colour=RED,
+            max_shown=20,
+            timeout=10,
+            rate=(5, 60),
+            bus=None,
+            )
 
     def start(self):
-        self.shown_notif = []
-
-        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-        session_bus = dbus.SessionBus()
-        self.name = dbus.service.BusName("org.freedesktop.Notifications",
-                session_bus)
-        self._nf = NotificationFetcher(session_bus,
-        "/org/freedesktop/Notifications")
+        super(Notification, self).start()
+        self.store = NotificationStore(self.params['max_shown'],
+                self.params['timeout'], self.params['rate'], self._closed)
+
+        import dbus.service
+        import gobject
+        self._idle_add = gobject.idle_add
+        bus = self.params['bus'] or session_bus()
+        self.name = dbus.service.BusName("org.freedesktop.Notifications", bus)
+        self._nf = fetcher_class()(bus, "/org/freedesktop/Notifications")
         self.queue = Queue.Queue()
         self._nf.queue = self.queue
+        self._nf.wakeup = self.wakeup
 
-        gobject.threads_init()
-        self._loop = gobject.MainLoop()
-        self._thread = start_new_thread(self._loop.run, tuple())
+    def stop(self):
+        self._nf.remove_from_connection()
+        del self.name
+        super(Notification, self).stop()
+
+    def check_update(self):
+        # shown notifications rotate and expire
+        return super(Notification, self).check_update() or len(self.store) > 0
+
+    def _closed(self, notification_id, reason):
+        # signals have to be emitted from the thread of the D-Bus loop
+        self._idle_add(self._nf.NotificationClosed, notification_id, reason)
 
     def update(self):
         while not self.queue.empty():
             new = self.queue.get_nowait()
-            if new == "CLEARNOTIFICATIONS":
-                self.shown_notif = []
+            if new[0] == "close":
+                self.store.close(new[1])
+            elif new[2] == "CLEARNOTIFICATIONS":
+                self.store.clear()
             else:
-                self.shown_notif.append(new)
+                self.store.add(*new[1:])
             self.queue.task_done()
-        if self.shown_notif:
-            show = self.shown_notif.pop(0)
-            self.shown_notif.append(show)
-        else:
-            show = ' '
-        return show
+        self.store.expire()
+        return self.store.next() or ' '
 
 
 if __name__ == "__main__": #let's test
-    import time
     for notif in Notification():
         print(notif)
         time.sleep(1)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+'''output module
+feeds the lines of a bar to a dzen2 process. only changed frames are
+written, bursts of frames are coalesced into one write per frame budget and
+a dzen2 that doesn't read its input never blocks the bar: stale frames are
+dropped in favour of the newest one. if dzen2 dies it is started again,
+right away the first time, then waiting longer and longer while it keeps
+dying (a bad argument, no display...).
+'''
+
+import errno
+import fcntl
+import os
+import subprocess
+import time
+
+
+class DzenOutput(object):
+    '''a dzen2 process (or any shell command) reading frames on stdin
+
+    schedule, if given, is a function(when, func) used to come back and
+    write a frame that had to wait for its budget or for the pipe to drain
+    (e.g. Scheduler.at); without it such frames go out with the next write.
+    a command that exits is restarted after a delay going from backoff[0]
+    up to backoff[1] seconds, doubling every time; it is reset once the
+    command has run for backoff[1] seconds.
+    '''
+    def __init__(self, command="dzen2", budget=0.05, schedule=None,
+            clock=time.time, backoff=(1, 60)):
+        self.command = command
+        self.budget = budget
+        self.schedule = schedule
+        self.clock = clock
+        self.backoff = backoff
+        self.delay = 0
+        self.started_at = None
+        self.restart_at = 0
+        self.proc = None
+        self.last = None
+        self.pending = None
+        self.buffer = ''
+        self.written_at = None
+        self._scheduled = False
+
+    def start(self):
+        self.proc = subprocess.Popen("exec " + self.command, shell=True,
+                stdin=subprocess.PIPE, close_fds=True)
+        self.started_at = self.clock()
+        fd = self.proc.stdin.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.buffer = ''
+        if self.pending is None:
+            self.pending = self.last
+
+    def stop(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+        self.proc.stdin.close()
+        self.proc = None
+
+    def _died(self):
+        '''the command exited: plan its restart'''
+        self.stop()
+        now = self.clock()
+        if now - self.started_at >= self.backoff[1]:
+            self.delay = 0
+        self.restart_at = now + self.delay
+        self.delay = min(max(self.delay * 2, self.backoff[0]),
+                self.backoff[1])
+
+    def close(self):
+        '''write the pending frame, then let the command read its input to
+        the end and exit'''
+        if self.proc is None:
+            return
+        if self.pending is not None:
+            self.buffer += self.pending + "\n"
+            self.last, self.pending = self.pending, None
+        fd = self.proc.stdin.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+        while self.buffer and self.proc is not None:
+            self._send()
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+    def write(self, line):
+        '''queue line as the newest frame, unless it is already shown'''
+        if line == self.pending:
+            return
+        if line == self.last:
+            self.pending = None
+            return
+        self.pending = line
+        self.flush()
+
+    def flush(self):
+        '''write what the frame budget and the pipe allow'''
+        if self.proc is not None and self.proc.poll() is not None:
+            self._died()
+        if self.proc is None and self.clock() >= self.restart_at:
+            self.start()
+        if self.proc is not None and self.buffer:
+            self._send()
+        if self.proc is not None and self.pending is not None \
+                and not self.buffer:
+            now = self.clock()
+            if (self.written_at is None
+                    or now - self.written_at >= self.budget):
+                self.buffer = self.pending + "\n"
+                self.last, self.pending = self.pending, None
+                self.written_at = now
+                self._send()
+        if (self.pending is not None or self.buffer) and self.schedule \
+                and not self._scheduled:
+            self._scheduled = True
+            if self.proc is None:
+                when = self.restart_at
+            elif self.buffer:
+                when = self.clock() + self.budget
+            else:
+                when = self.written_at + self.budget
+            self.schedule(when, self._retry)
+
+    def _retry(self):
+        self._scheduled = False
+        self.flush()
+
+    def _send(self):
+        try:
+            count = os.write(self.proc.stdin.fileno(), self.buffer)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            if e.errno != errno.EPIPE:
+                raise
+            self._died()
+            return
+        self.buffer = self.buffer[count:]
+
+
+class MultiOutput(object):
+    '''several outputs, each one showing its own slice of a line
+
+    bars is a sequence of (output, count): the first count values of the
+    line go to the first output, the next ones to the second and so on.
+    '''
+    def __init__(self, bars):
+        self.bars = []
+        self.set_bars(bars)
+
+    def set_bars(self, bars):
+        '''switch to new bars, stopping the outputs no longer used'''
+        old = set(output for output, start, end in self.bars)
+        self.bars = []
+        start = 0
+        for output, count in bars:
+            self.bars.append((output, start, start + count))
+            start += count
+            old.discard(output)
+        for output in old:
+            output.stop()
+
+    def write(self, values):
+        for output, start, end in self.bars:
+            output.write(" ".join(values[start:end]))
+
+    def stop(self):
+        for output, start, end in self.bars:
+            output.stop()
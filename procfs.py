@@ -0,0 +1,251 @@
+#!/usr/bin/python
+'''procfs module
+readers for the kernel pseudo-files (procfs and sysfs) the bar elements
+sample. files are kept open between ticks, so that an update doesn't pay for
+an open() every time.
+'''
+
+import io
+import re
+import select
+import threading
+import time
+import timeit
+from array import array
+
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def procfile_parse(stream):
+    ret = (line.split(':', 1) for line in stream if ':' in line)
+    return dict((k.strip(), v.strip()) for k,v in ret)
+
+
+class ProcFile(object):
+    '''a "key: value" kernel file kept open and re-read in place
+
+    the content is read into a reusable buffer and only the requested keys
+    are extracted, instead of building a dict out of every line.
+    '''
+    def __init__(self, path, keys=(), bufsize=4096):
+        self.file = io.FileIO(path, 'r')
+        self.keys = tuple(keys)
+        self._patterns = tuple("\n" + key + ":" for key in self.keys)
+        self.buf = bytearray(bufsize)
+        self.size = 0
+
+    def read(self):
+        '''re-read the whole file into the buffer, growing it if needed'''
+        self.file.seek(0)
+        view = memoryview(self.buf)
+        size = 0
+        while True:
+            if size == len(self.buf):
+                del view
+                self.buf.extend(bytearray(len(self.buf)))
+                view = memoryview(self.buf)
+            count = self.file.readinto(view[size:])
+            if not count:
+                break
+            size += count
+        self.size = size
+        return size
+
+    def values(self):
+        '''first word of the value of every requested key, in order'''
+        self.read()
+        buf, size = self.buf, self.size
+        ret = []
+        for key, pattern in zip(self.keys, self._patterns):
+            if buf.startswith(pattern[1:]):
+                start = len(pattern) - 1
+            else:
+                start = buf.find(pattern, 0, size)
+                if start < 0:
+                    raise KeyError(key)
+                start += len(pattern)
+            end = buf.find("\n", start, size)
+            if end < 0:
+                end = size
+            while start < end and buf[start] == 32:
+                start += 1
+            space = buf.find(" ", start, end)
+            ret.append(str(buf[start:end if space < 0 else space]))
+        return ret
+
+
+class AttrFile(object):
+    '''a single value sysfs attribute, kept open and re-read in place'''
+    def __init__(self, path):
+        self.file = io.FileIO(path, 'r')
+
+    def read(self):
+        self.file.seek(0)
+        return self.file.read(4096).strip()
+
+    def close(self):
+        self.file.close()
+
+
+class StatSampler(object):
+    '''CPU and network counters shared by every element that shows them
+
+    /proc/stat and /proc/net/dev are read once per tick of `interval`
+    seconds no matter how many elements call sample(): calls less than
+    half an interval after the last read are taken as the same tick, so
+    the jitter of the scheduler never makes a tick skip its read. the
+    results live in arrays allocated once: cpu_usage[0] is the overall
+    busy fraction and cpu_usage[n + 1] the one of core n; net_rates[2 * i]
+    and net_rates[2 * i + 1] are the received and transmitted bytes per
+    second of the interface named interfaces[i]. the elements sampling it
+    run on several pool threads: they read through usage() and rates(),
+    which hold the same lock as sample().
+    '''
+    _shared = None
+
+    def __init__(self, interval=1, stat="/proc/stat", netdev="/proc/net/dev",
+            clock=time.time):
+        self.interval = interval
+        self.clock = clock
+        self._stat = ProcFile(stat)
+        self._netdev = ProcFile(netdev)
+        self.sampled_at = None
+        self.samples = 0
+        self.cpu_usage = array('d')
+        self._cpu_prev = array('d')
+        self.interfaces = []
+        self.net_rates = array('d')
+        self._net_prev = array('d')
+        self.lock = threading.Lock()
+        self.sample()
+
+    @classmethod
+    def shared(cls):
+        '''the sampler instance used by the default elements'''
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def sample(self):
+        '''read the counters again, unless it was done in this tick'''
+        with self.lock:
+            now = self.clock()
+            if self.sampled_at is not None:
+                elapsed = now - self.sampled_at
+                if elapsed < self.interval / 2.0:
+                    return
+            else:
+                elapsed = 0
+            self.sampled_at = now
+            self.samples += 1
+            self._sample_cpu()
+            self._sample_net(elapsed)
+
+    def _sample_cpu(self):
+        self._stat.read()
+        lines = str(self._stat.buf[:self._stat.size]).split("\n")
+        cpus = [line for line in lines if line.startswith("cpu")]
+        if len(cpus) != len(self.cpu_usage):
+            self.cpu_usage = array('d', [0.0] * len(cpus))
+            self._cpu_prev = array('d', [0.0] * (2 * len(cpus)))
+        prev, usage = self._cpu_prev, self.cpu_usage
+        for i, line in enumerate(cpus):
+            fields = line.split()[1:9]
+            total = float(sum(int(field) for field in fields))
+            idle = int(fields[3]) + int(fields[4])
+            busy = total - idle
+            delta = total - prev[2 * i]
+            usage[i] = (busy - prev[2 * i + 1]) / delta if delta > 0 else 0.0
+            prev[2 * i], prev[2 * i + 1] = total, busy
+
+    def _sample_net(self, elapsed):
+        self._netdev.read()
+        lines = str(self._netdev.buf[:self._netdev.size]).split("\n")[2:]
+        stats = [line.split(":", 1) for line in lines if ":" in line]
+        names = [name.strip() for name, counters in stats]
+        if names != self.interfaces:
+            self.net_rates = array('d', [0.0] * (2 * len(names)))
+            self._net_prev = array('d', [0.0] * (2 * len(names)))
+            self.interfaces = names
+            elapsed = 0
+        prev, rates = self._net_prev, self.net_rates
+        for i, (name, counters) in enumerate(stats):
+            counters = counters.split()
+            for j, count in enumerate((float(counters[0]), float(counters[8]))):
+                delta = count - prev[2 * i + j]
+                rates[2 * i + j] = delta / elapsed if elapsed and delta > 0 \
+                        else 0.0
+                prev[2 * i + j] = count
+
+    def usage(self):
+        '''copy of cpu_usage'''
+        with self.lock:
+            return list(self.cpu_usage)
+
+    def rates(self, interface):
+        '''(received, transmitted) bytes per second of interface'''
+        with self.lock:
+            try:
+                i = self.interfaces.index(interface)
+            except ValueError:
+                return None
+            return self.net_rates[2 * i], self.net_rates[2 * i + 1]
+
+
+def unescape_mountpoint(path):
+    '''undo the octal escaping of spaces & co. done by the kernel'''
+    return _OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), path)
+
+
+def parse_mountinfo(stream):
+    '''mount points listed in a mountinfo formatted stream'''
+    for line in stream:
+        fields = line.split(' ', 5)
+        if len(fields) > 4:
+            yield unescape_mountpoint(fields[4])
+
+
+class MountTable(object):
+    '''set of currently mounted paths
+
+    the mountinfo file is read again only after the kernel signals a change
+    on it with POLLPRI, so checking it every tick costs a single poll(0).
+    '''
+    def __init__(self, path="/proc/self/mountinfo"):
+        self.file = open(path)
+        self._poll = select.poll()
+        self._poll.register(self.file, select.POLLPRI | select.POLLERR)
+        self.reload()
+
+    def reload(self):
+        self.file.seek(0)
+        self.mounts = frozenset(parse_mountinfo(self.file))
+
+    def check(self):
+        '''reload the table if it changed, return True if it did'''
+        if self._poll.poll(0):
+            self.reload()
+            return True
+        return False
+
+    def __contains__(self, path):
+        self.check()
+        return path in self.mounts
+
+
+def benchmark(path="/proc/meminfo", keys=("MemTotal", "Committed_AS"),
+        number=20000):
+    '''per-tick cost of open()+procfile_parse against a ProcFile'''
+    def reopen():
+        with open(path) as f:
+            meminfo = procfile_parse(f)
+        return [meminfo[key].split()[0] for key in keys]
+    reader = ProcFile(path, keys)
+    assert reopen() == reader.values()
+    for name, func in (("open+parse", reopen), ("ProcFile", reader.values)):
+        best = min(timeit.repeat(func, number=number, repeat=3))
+        print("{0:>12}: {1:.2f} us/tick".format(name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    benchmark()
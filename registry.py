@@ -0,0 +1,46 @@
+#!/usr/bin/python
+'''registry module
+bar elements by name. the module defining an element is imported only when
+the element is asked for, and the libraries of its backend (dbus, alsaaudio,
+gobject...) only when it is instantiated, so a bar starts paying only for
+the elements it shows and doesn't break on a backend it doesn't use.
+'''
+
+import importlib
+
+ELEMENTS = {
+    "Time": "basicelements",
+    "Load": "basicelements",
+    "Battery": "basicelements",
+    "MprisPlayer": "basicelements",
+    "Audio": "basicelements",
+    "MocpPlayer": "basicelements",
+    "MpdPlayer": "basicelements",
+    "Memory": "basicelements",
+    "Cpu": "basicelements",
+    "Network": "basicelements",
+    "DiskUsage": "basicelements",
+    "IMAPRecent": "basicelements",
+    "Notification": "notification",
+    "Mpris2Player": "mpris",
+    "Ingest": "ingest",
+}
+
+
+def register(name, module):
+    '''make the element class `name` of `module` available by name'''
+    ELEMENTS[name] = module
+
+
+def lookup(name):
+    '''the element class registered as name, importing its module'''
+    try:
+        module = ELEMENTS[name]
+    except KeyError:
+        raise KeyError("unknown element {0!r}".format(name))
+    return getattr(importlib.import_module(module), name)
+
+
+def create(name, *args, **kwargs):
+    '''a new element of the class registered as name'''
+    return lookup(name)(*args, **kwargs)
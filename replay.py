@@ -0,0 +1,206 @@
+#!/usr/bin/python
+'''replay module
+records the values the elements of a bar take, with the time each one
+changed, and plays such a trace back at a higher speed through the real
+scheduler and output into a headless sink (see sink.py). every change is
+then matched with the first frame showing it, giving the latency from a
+source event to the line and the number of frames written per event, to be
+compared between versions.
+
+    replay.py record TRACE SECONDS [CONFIG]
+    replay.py run TRACE [SPEED]
+'''
+
+import json
+import math
+import os
+import pipes
+import sys
+import tempfile
+import threading
+import time
+
+from config import Config
+from dzentools import BarElement, DzenString
+from output import DzenOutput
+from scheduler import PushMixin, Scheduler, UpdatePool
+import sink
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _text(value):
+    if isinstance(value, DzenString):
+        value = str(value)
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    return value
+
+
+class Recorder(object):
+    '''writes a JSON line to stream every time an element changes value
+
+    the update() of every element is wrapped; the lines hold the time since
+    the recorder was created, the index and class of the element and the
+    markup of its new value.
+    '''
+    def __init__(self, elements, stream, clock=time.time):
+        self.stream = stream
+        self.clock = clock
+        self.start = clock()
+        self._lock = threading.Lock()
+        for i, elm in enumerate(elements):
+            elm.update = self._wrap(i, elm, elm.update)
+
+    def _wrap(self, index, elm, update):
+        last = [None]
+        def recorded():
+            ret = update()
+            value = _text(ret)
+            if value != last[0]:
+                last[0] = value
+                record = dict(t=self.clock() - self.start, element=index,
+                        type=type(elm).__name__, value=value)
+                with self._lock:
+                    self.stream.write(json.dumps(record) + "\n")
+            return ret
+        return recorded
+
+
+def read_trace(stream):
+    return [json.loads(line) for line in stream if line.strip()]
+
+
+class ReplayElement(PushMixin, BarElement):
+    '''element showing the values a Replayer sets, woken up by each one'''
+    INTERVAL = 3600
+
+    def start(self):
+        super(ReplayElement, self).start()
+        self.value = " "
+
+    def set(self, value):
+        self.value = value
+        self.push()
+
+    def update(self):
+        return self.value
+
+
+class Replayer(object):
+    '''plays a trace back `speed` times faster than it was recorded
+
+    injected lists (time, element, value) of every event as it was set.
+    '''
+    def __init__(self, events, speed=10, clock=time.time, sleep=time.sleep):
+        self.events = sorted(events, key=lambda event: event["t"])
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        count = max(event["element"] for event in self.events) + 1
+        self.elements = [ReplayElement() for i in range(count)]
+        self.scheduler = Scheduler(self.elements, clock)
+        self.injected = []
+
+    def inject(self, settle=1.0):
+        '''set the values at their time, then end the scheduler loop'''
+        start = self.clock()
+        for event in self.events:
+            delay = start + event["t"] / self.speed - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            self.injected.append((self.clock(), event["element"],
+                event["value"]))
+            self.elements[event["element"]].set(event["value"])
+        self.sleep(settle)
+        # an empty value stops the scheduler
+        self.elements[0].set("")
+
+    def run(self, output, settle=1.0):
+        '''play the trace through the scheduler, writing to output'''
+        thread = threading.Thread(target=self.inject, args=(settle,))
+        thread.daemon = True
+        thread.start()
+        for line in self.scheduler:
+            output.write(" ".join(line))
+        thread.join()
+
+
+def percentile(values, percent):
+    '''nearest-rank percentile of values'''
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank - 1, 0)]
+
+
+def analyse(injected, frames):
+    '''latency percentiles (in ms) and frames per event of a replay'''
+    latencies = []
+    missed = 0
+    for when, element, value in injected:
+        for shown, line, errors in frames:
+            if shown >= when and value in line:
+                latencies.append((shown - when) * 1000)
+                break
+        else:
+            missed += 1
+    ret = dict(events=len(injected), frames=len(frames), missed=missed,
+            invalid=sum(1 for frame in frames if frame[2]),
+            frames_per_event=float(len(frames)) / max(len(injected), 1))
+    for percent in (50, 90, 99, 100):
+        ret["p{0}_ms".format(percent)] = percentile(latencies, percent)
+    return ret
+
+
+def record(path, seconds, config_path):
+    '''record the elements of a configuration for some seconds'''
+    config = Config(config_path)
+    config.load()
+    scheduler = Scheduler(config.all_views(), pool=UpdatePool())
+    end = time.time() + seconds
+    with open(path, "w") as stream:
+        Recorder(scheduler.elements, stream)
+        for line in scheduler:
+            if time.time() >= end:
+                break
+    for elm in scheduler.elements:
+        elm.stop()
+
+
+def replay(path, speed):
+    '''replay a trace into a sink, return the analysis'''
+    with open(path) as stream:
+        replayer = Replayer(read_trace(stream), speed)
+    fd, log = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        output = DzenOutput(" ".join(pipes.quote(arg) for arg in
+            (sys.executable, os.path.join(BASEDIR, "sink.py"), log)),
+            schedule=replayer.scheduler.at)
+        replayer.run(output)
+        output.close()
+        with open(log) as stream:
+            frames = list(sink.read_frames(stream))
+    finally:
+        os.remove(log)
+    return analyse(replayer.injected, frames)
+
+
+def main(args):
+    if args[:1] == ["record"] and len(args) in (3, 4):
+        config = args[3] if len(args) > 3 else \
+                os.path.join(BASEDIR, "statusbar.json")
+        record(args[1], float(args[2]), config)
+    elif args[:1] == ["run"] and len(args) in (2, 3):
+        speed = float(args[2]) if len(args) > 2 else 10
+        print(json.dumps(replay(args[1], speed), sort_keys=True))
+    else:
+        sys.stderr.write(__doc__)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+'''scheduler module
+drives a set of BarElement, each one at its own pace. ticks are aligned to
+wall-clock boundaries (a 1 second element fires right after every second,
+a 60 seconds one right after every minute) so slow elements don't make the
+clock drift, and a new line is produced only when something changed.
+updates can be moved to a pool of worker threads, so that a hung source
+only turns its own element stale instead of freezing the whole bar.
+elements exposing wakeup file descriptors are updated as soon as one of
+them becomes readable, without waiting for their next tick.
+'''
+
+import errno
+import fcntl
+import heapq
+import itertools
+import math
+import os
+import select
+import time
+import threading
+import Queue
+
+from dzentools import View
+
+
+def align(now, interval):
+    '''first multiple of interval strictly after now'''
+    return (math.floor(now / interval) + 1) * interval
+
+
+class Wakeup(object):
+    '''self-pipe a thread can use to wake the scheduler up'''
+    def __init__(self):
+        self.rfd, self.wfd = os.pipe()
+        for fd in (self.rfd, self.wfd):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self.rfd
+
+    def set(self):
+        try:
+            os.write(self.wfd, "!")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def clear(self):
+        try:
+            while os.read(self.rfd, 512):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        if self.rfd is not None:
+            os.close(self.rfd)
+            os.close(self.wfd)
+            self.rfd = self.wfd = None
+
+
+class PushMixin(object):
+    '''for the BarElement subclasses whose value changes in another thread
+    (a D-Bus callback, the connection of a watcher...)
+
+    push(), callable from any thread, makes the element due right away;
+    in between, check_update() keeps the element from being updated.
+    subclasses chain start() and stop() with super(). those watching
+    descriptors of their own return them from wakeup_fds() instead and set
+    _pushed when one is readable.
+    '''
+    def start(self):
+        self.wakeup = Wakeup()
+        self._pushed = False
+        super(PushMixin, self).start()
+
+    def stop(self):
+        super(PushMixin, self).stop()
+        self.wakeup.close()
+
+    def push(self):
+        self.wakeup.set()
+
+    def wakeup_fds(self):
+        return [self.wakeup.fileno()]
+
+    def handle_wakeup(self, fd):
+        self.wakeup.clear()
+        self._pushed = True
+
+    def check_update(self):
+        pushed, self._pushed = self._pushed, False
+        return pushed
+
+
+class ReconnectingWatcher(object):
+    '''a daemon thread holding a connection to a server
+
+    subclasses define connect(), returning a connection with a close()
+    method, watch(conn), following the server until stopped, and
+    lost(error), called when one of `errors` breaks the connection. it is
+    then opened again, waiting from backoff[0] up to backoff[1] seconds,
+    doubling every failure. stop() doesn't wait for a connect() in
+    progress: the connection it returns is closed by the thread.
+    '''
+    errors = (EnvironmentError,)
+
+    def __init__(self, backoff=(1, 60)):
+        self.backoff = backoff
+        self.conn = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def lost(self, error):
+        pass
+
+    def _close(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            conn.close()
+
+    def run(self):
+        delay = self.backoff[0]
+        while not self._stop.is_set():
+            try:
+                self.conn = self.connect()
+                # stopped while connecting: stop() found no conn to close
+                if self._stop.is_set():
+                    break
+                delay = self.backoff[0]
+                self.watch(self.conn)
+            except self.errors as e:
+                self._close()
+                if self._stop.is_set():
+                    break
+                self.lost(e)
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.backoff[1])
+        self._close()
+
+    def stop(self, timeout=1):
+        '''close the connection, wait up to timeout for the thread'''
+        self._stop.set()
+        self._close()
+        self._thread.join(timeout)
+
+
+class Job(object):
+    '''a function call queued on an UpdatePool'''
+    def __init__(self, func):
+        self.func = func
+        self.result = None
+        self.done = threading.Event()
+
+    def run(self):
+        # whatever func raises, the worker has to survive it
+        try:
+            self.result = self.func()
+        except Exception as e:
+            self.result = repr(e)
+        finally:
+            self.done.set()
+
+    def wait(self, timeout):
+        '''True if the job completed within timeout seconds'''
+        if not self.done.is_set() and timeout > 0:
+            self.done.wait(timeout)
+        return self.done.is_set()
+
+
+class UpdatePool(object):
+    '''fixed set of daemon threads running queued jobs'''
+    def __init__(self, workers=4):
+        self.jobs = Queue.Queue()
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            self.jobs.get().run()
+
+    def submit(self, func):
+        job = Job(func)
+        self.jobs.put(job)
+        return job
+
+
+class Scheduler(object):
+    '''iterable yielding the list of element outputs every time it changes
+
+    every element is updated when its own interval expires; elements that
+    are not due keep their previous output in the line. with a pool, all
+    the due elements are started together and each one is waited only up
+    to its own deadline. the items can also be views (see dzentools.View):
+    an element shown by several views is still updated once per interval,
+    and its value rendered by each of them.
+    '''
+    def __init__(self, elements, clock=time.time, sleep=time.sleep,
+            pool=None, select=select.select):
+        self.pool = pool
+        self.clock = clock
+        self.sleep = sleep
+        self.select = select
+        self.views = []
+        self.elements = []
+        self.values = []
+        self.due = []
+        self.timers = []
+        self._timer_seq = itertools.count()
+        self.watched = {}
+        self.watched_write = {}
+        self.reconfigure(elements)
+
+    def reconfigure(self, elements):
+        '''show elements (or views) from now on
+
+        the output of views already shown and the schedule of elements
+        already known are kept; only the new ones are updated right away.
+        '''
+        values = dict(zip(self.views, self.values))
+        due = dict(zip(self.elements, self.due))
+        self.views = [elm if isinstance(elm, View) else elm.view
+                for elm in elements]
+        self.elements = []
+        self.sources = []
+        for view in self.views:
+            if view.element not in self.elements:
+                self.elements.append(view.element)
+            self.sources.append(self.elements.index(view.element))
+        if self.pool is not None:
+            for elm in self.elements:
+                elm.pool = self.pool
+        self.values = [values.get(view) for view in self.views]
+        self.due = [due.get(elm, 0.0) for elm in self.elements]
+        for value, i in zip(self.values, self.sources):
+            if value is None:
+                self.due[i] = 0.0
+        self._reconfigured = True
+
+    def at(self, when, func):
+        '''call func (once) as soon as the clock reaches when'''
+        heapq.heappush(self.timers, (when, next(self._timer_seq), func))
+
+    def run_timers(self, now):
+        while self.timers and self.timers[0][0] <= now:
+            heapq.heappop(self.timers)[2]()
+
+    def watch(self, fd, callback, write=False):
+        '''call callback(fd) from the loop whenever fd is readable (or
+        writable)'''
+        (self.watched_write if write else self.watched)[fd] = callback
+
+    def unwatch(self, fd, write=False):
+        (self.watched_write if write else self.watched).pop(fd, None)
+
+    def wait(self, timeout):
+        '''sleep up to timeout, or until an element wakeup fd is readable'''
+        fds = {}
+        for i, elm in enumerate(self.elements):
+            for fd in elm.wakeup_fds():
+                fds.setdefault(fd, []).append(i)
+        if not fds and not self.watched and not self.watched_write:
+            self.sleep(timeout)
+            return
+        try:
+            ready, writable = self.select(list(set(fds) | set(self.watched)),
+                    list(self.watched_write), [], timeout)[:2]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for fd in writable:
+            callback = self.watched_write.get(fd)
+            if callback is not None:
+                callback(fd)
+        for fd in ready:
+            callback = self.watched.get(fd)
+            if callback is not None:
+                callback(fd)
+            for i in fds.get(fd, ()):
+                self.elements[i].handle_wakeup(fd)
+                self.due[i] = 0.0
+
+    def dump_stats(self, stream):
+        '''write the update statistics of every element to stream'''
+        for i, elm in enumerate(self.elements):
+            stream.write("{0:2d} {1:<14} {2}\n".format(i,
+                type(elm).__name__, elm.stats))
+        stream.flush()
+
+    def tick(self, now):
+        '''update every element due at now, return True if the line changed'''
+        changed, self._reconfigured = self._reconfigured, False
+        due = [i for i, elm in enumerate(self.elements) if self.due[i] <= now]
+        if not due:
+            return changed
+        for i in due:
+            if self.elements[i].pool is not None:
+                self.elements[i].submit()
+        samples = {}
+        for i in due:
+            elm = self.elements[i]
+            samples[i] = elm.sample()
+            self.due[i] = align(now, elm.interval)
+        rendered = {}
+        for j, view in enumerate(self.views):
+            i = self.sources[j]
+            if i not in samples:
+                continue
+            if view not in rendered:
+                rendered[view] = view.render(samples[i],
+                        self.elements[i].stale)
+            if rendered[view] != self.values[j]:
+                self.values[j] = rendered[view]
+                changed = True
+        return changed
+
+    def __iter__(self):
+        while True:
+            now = self.clock()
+            self.run_timers(now)
+            if self.tick(now):
+                yield list(self.values)
+            wake = min(self.due)
+            if self.timers:
+                wake = min(wake, self.timers[0][0])
+            delay = wake - self.clock()
+            if delay > 0:
+                self.wait(delay)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+'''sink module
+headless stand-in for dzen2: reads frames on stdin like dzen2 does, but
+instead of drawing them it timestamps each one and checks its markup, so the
+output of a bar can be measured without an X display. as a program:
+
+    sink.py [LOG]
+
+every frame is appended to LOG (stdout by default) as a JSON line
+{"t": arrival time, "line": frame, "errors": [markup problems]}; pass
+"python sink.py LOG" as the command of a DzenOutput to use it.
+'''
+
+import json
+import sys
+import time
+
+from dzentools import MarkupError, parse_markup
+
+
+def validate_markup(line):
+    '''problems dzen2 would have with the markup of line'''
+    try:
+        elements = parse_markup(line)
+    except MarkupError as e:
+        return [str(e)]
+    errors = []
+    areas = 0
+    for elm in elements:
+        if type(elm) is not tuple or elm[0] != "ca":
+            continue
+        if not elm[1]:
+            areas -= 1
+            if areas < 0:
+                errors.append("^ca() closing no click area")
+                areas = 0
+        else:
+            button = elm[1].split(",", 1)[0]
+            if "," not in elm[1] or not button.isdigit():
+                errors.append("^ca({0}) without a button".format(elm[1]))
+            areas += 1
+    if areas:
+        errors.append("{0} click area(s) not closed".format(areas))
+    return errors
+
+
+def read_frames(stream):
+    '''(time, line, errors) of every frame logged by a sink'''
+    for record in stream:
+        record = json.loads(record)
+        yield record["t"], record["line"], record["errors"]
+
+
+def run(infile, log, clock=time.time):
+    '''log every frame read from infile until it is closed'''
+    for line in iter(infile.readline, ''):
+        now = clock()
+        line = line.rstrip("\n").decode('utf-8', 'replace')
+        log.write(json.dumps(dict(t=now, line=line,
+            errors=validate_markup(line))) + "\n")
+        log.flush()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "a") as log:
+            run(sys.stdin, log)
+    else:
+        run(sys.stdin, sys.stdout)
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+'''statusserver module
+publishes the values the bar already has on a Unix socket, so that lock
+screens, tmux status lines and scripts don't sample the same sources again.
+clients send one command line:
+
+    get            one JSON line {name: {"value", "markup", "stale"}}
+    get NAME       the plain value of the element NAME, one line
+    subscribe      the JSON snapshot, then one JSON line with the elements
+                   that changed every time the bar changes
+    subscribe NAME the plain value of NAME, again on every change of it
+
+elements are named after their class, with ".2", ".3"... appended to the
+later ones of the same class. answering never updates an element: only the
+values of the last tick are served, each one encoded once for all the
+clients, and nothing is done when no client is connected. clients are
+written to without blocking. as a program:
+
+    statusserver.py [get|subscribe] [NAME]
+'''
+
+import errno
+import json
+import os
+import socket
+import stat
+import sys
+
+from dzentools import plain_text
+
+SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"),
+        "statusbar.{0}.sock".format(os.getuid()))
+
+
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class StatusServer(object):
+    '''serves the element values of a Scheduler on a Unix socket
+
+    publish() has to be called after every tick that changed the line.
+    what a client doesn't read at once is sent when its socket is writable
+    again; clients are dropped once more than max_buffer bytes are waiting
+    for them.
+    '''
+    def __init__(self, scheduler, path=SOCKET, max_buffer=65536):
+        self.scheduler = scheduler
+        self.path = path
+        self.max_buffer = max_buffer
+        # None until a client needs them, so that nothing is done per tick
+        # while nobody listens
+        self.entries = None
+        self.clients = {}
+        self._remove_stale(path)
+        self.listener = socket.socket(socket.AF_UNIX)
+        self.listener.setblocking(False)
+        self.listener.bind(path)
+        self.listener.listen(16)
+        scheduler.watch(self.listener.fileno(), self._accept)
+
+    def _remove_stale(self, path):
+        '''remove the socket a bar left at path when it died, refuse to
+        take the one of a bar still running'''
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except socket.error as e:
+            # anything but a socket is left for bind() to fail on
+            if e.args[0] == errno.ECONNREFUSED and \
+                    stat.S_ISSOCK(os.lstat(path).st_mode):
+                os.remove(path)
+            elif e.args[0] not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+        else:
+            raise socket.error(errno.EADDRINUSE,
+                    "another bar is serving on {0}".format(path))
+        finally:
+            probe.close()
+
+    def close(self):
+        for fd in list(self.clients):
+            self._drop(fd)
+        self.scheduler.unwatch(self.listener.fileno())
+        self.listener.close()
+        os.remove(self.path)
+
+    def snapshot(self):
+        '''{name: {"value", "markup", "stale"}} of every element shown'''
+        scheduler = self.scheduler
+        ret = {}
+        counts = {}
+        for i, elm in enumerate(scheduler.elements):
+            name = type(elm).__name__
+            counts[name] = counts.get(name, 0) + 1
+            if counts[name] > 1:
+                name += ".{0}".format(counts[name])
+            markup = scheduler.values[scheduler.sources.index(i)]
+            ret[name] = dict(value=_unicode(plain_text(elm.last or '')),
+                    markup=_unicode(markup or ''), stale=elm.stale)
+        return ret
+
+    def publish(self):
+        '''send what changed since the last call to the subscribers'''
+        if not self.clients:
+            self.entries = None
+            return
+        entries = self.snapshot()
+        old = self.entries or {}
+        changed = dict((name, entry) for name, entry in entries.items()
+                if old.get(name) != entry)
+        self.entries = entries
+        if not changed:
+            return
+        encoded = {None: json.dumps(changed) + "\n"}
+        for fd, client in self.clients.items():
+            name = client["subscribed"]
+            if name is False or (name is not None and name not in changed):
+                continue
+            if name not in encoded:
+                encoded[name] = self._value_line(name)
+            self._send(fd, encoded[name])
+
+    def _value_line(self, name):
+        entry = (self.entries or {}).get(name)
+        value = entry["value"] if entry else u""
+        return value.replace("\n", " ").encode('utf-8') + "\n"
+
+    def _accept(self, fd):
+        while True:
+            try:
+                sock = self.listener.accept()[0]
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(False)
+            self.clients[sock.fileno()] = dict(sock=sock, input='',
+                    output='', subscribed=False, closing=False)
+            self.scheduler.watch(sock.fileno(), self._read)
+
+    def _read(self, fd):
+        client = self.clients[fd]
+        try:
+            data = client["sock"].recv(4096)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._drop(fd)
+            return
+        client["input"] += data
+        if "\n" not in client["input"]:
+            if len(client["input"]) > 4096:
+                self._drop(fd)
+            return
+        line, client["input"] = client["input"].split("\n", 1)
+        self._command(fd, line.split())
+
+    def _command(self, fd, args):
+        if self.entries is None:
+            self.entries = self.snapshot()
+        command, name = (args + [None, None])[:2]
+        if command in ("get", "subscribe"):
+            if name is None:
+                answer = json.dumps(self.entries) + "\n"
+            else:
+                answer = self._value_line(name)
+        else:
+            answer = "unknown command\n"
+        if command == "subscribe":
+            self.clients[fd]["subscribed"] = name
+        else:
+            # answered: closed once the answer is sent
+            self.clients[fd]["closing"] = True
+            self.scheduler.unwatch(fd)
+        self._send(fd, answer)
+
+    def _send(self, fd, data):
+        client = self.clients.get(fd)
+        if client is None:
+            return
+        waiting = bool(client["output"])
+        client["output"] += data
+        if not waiting:
+            self._flush(fd)
+        elif len(client["output"]) > self.max_buffer:
+            self._drop(fd)
+
+    def _flush(self, fd):
+        '''send what the socket takes of the output of a client'''
+        client = self.clients[fd]
+        try:
+            sent = client["sock"].send(client["output"])
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._drop(fd)
+                return
+            sent = 0
+        client["output"] = client["output"][sent:]
+        if len(client["output"]) > self.max_buffer:
+            self._drop(fd)
+        elif client["output"]:
+            self.scheduler.watch(fd, self._flush, write=True)
+        else:
+            self.scheduler.unwatch(fd, write=True)
+            if client["closing"]:
+                self._drop(fd)
+
+    def _drop(self, fd):
+        client = self.clients.pop(fd)
+        self.scheduler.unwatch(fd)
+        self.scheduler.unwatch(fd, write=True)
+        client["sock"].close()
+
+
+def query(args, path=SOCKET, out=sys.stdout):
+    '''send a command to a running bar and copy its answer to out'''
+    sock = socket.socket(socket.AF_UNIX)
+    sock.connect(path)
+    sock.sendall(" ".join(args or ["get"]) + "\n")
+    for data in iter(lambda: sock.recv(4096), ''):
+        out.write(data)
+        out.flush()
+    sock.close()
+
+
+if __name__ == "__main__":
+    query(sys.argv[1:])
@@ -2,11 +2,41 @@
 #vim:fileencoding=utf-8
 
 import unittest
+import errno
 import os.path
+import shutil
+import tempfile
+import select
+import socket
+import threading
+import StringIO
+import json
+import subprocess
+import sys
+import time
 import warnings
-from mock import Mock
+import types
+import posix
+from mock import Mock, patch
 
-from dzentools import ForegroundColour, DzenString, BarElement, Icon
+from dzentools import ForegroundColour, DzenString, BarElement, Icon, Template
+from dzentools import ElementStats, History, Graph, View
+from dzentools import MarkupError, parse_markup, plain_text
+from scheduler import PushMixin, ReconnectingWatcher, Scheduler, UpdatePool
+from scheduler import Wakeup, align
+from procfs import MountTable, ProcFile, StatSampler
+from output import DzenOutput, MultiOutput
+from mpdidle import MpdConnection, MpdWatcher
+from imapidle import ImapConnection, ImapError, ImapWatcher
+from mpris import Mpris2Player
+import registry
+from basicelements import Audio, Battery, DiskUsage, IMAPRecent, human_size
+from config import Config, ConfigError
+import sink
+import replay
+from ingest import Ingest
+from statusserver import StatusServer, query
+import notification
 
 class ColourTest(unittest.TestCase):
     def test_color_apply(self):
@@ -54,6 +84,56 @@ class DzenStringTest(unittest.TestCase):
         else:
             self.assertTrue(all(result), "results: "+ repr(result))
 
+    def test_lazy_rope(self):
+        prova = DzenString("a^")
+        for i in range(5000):
+            prova += DzenString(("i", "x"), "b")
+        self.assertTrue(prova._str is None)
+        self.assertEqual(len(prova), 3 + 5000 * 6)
+        self.assertTrue(str(prova).startswith("a^^^i(x)b^i(x)b"))
+
+    def test_elements(self):
+        prova = "a" + DzenString(("lol", "lal")) + DzenString("b")
+        self.assertEqual(prova.elements, ("a", ("lol", "lal"), "b"))
+
+    def test_cached_part(self):
+        part = ForegroundColour("c")("x^")
+        self.assertEqual(str(part), "^fg(c)x^^^fg()")
+        self.assertEqual(str(part + part), "^fg(c)x^^^fg()^fg(c)x^^^fg()")
+        nested = ForegroundColour("d")(part)
+        self.assertEqual(str(nested), "^fg(d)^fg(c)x^^^fg(d)^fg()")
+
+    def test_not_equal(self):
+        self.assertNotEqual(DzenString("None"), None)
+        self.assertTrue(DzenString("a") != "b")
+        self.assertEqual(len(set([DzenString("a"), "a"])), 1)
+
+
+class MarkupTest(unittest.TestCase):
+    def test_round_trip(self):
+        markup = "^fg(red)a^^b^i(x.xbm)^fg() c^ca(1,ls)d^ca()"
+        elements = parse_markup(markup)
+        self.assertEqual(elements, [("fg", "red"), "a^b", ("i", "x.xbm"),
+            ("fg", ""), " c", ("ca", "1,ls"), "d", ("ca", "")])
+        self.assertEqual(DzenString(*elements), markup)
+
+    def test_invalid(self):
+        for markup in ("a^b", "^fg(red", "^xx(1)", "end^"):
+            self.assertRaises(MarkupError, parse_markup, markup)
+
+    def test_from_markup(self):
+        for markup, expected in (("a^b", "a^^b"),
+                ("^fg(red)x", "^fg(red)x^fg()"),
+                ("^pa(10)x^ca(1,ls)y", "x^ca(1,ls)y^ca()"),
+                ("x^ca()", "x"),
+                ("^bg(a)^fg(b)c^fg()", "^bg(a)^fg(b)c^fg()^bg()")):
+            self.assertEqual(DzenString.from_markup(markup), expected)
+
+    def test_plain_text(self):
+        self.assertEqual(plain_text("^fg(red)a^^b^fg() c"), "a^b c")
+        self.assertEqual(plain_text(ForegroundColour("red")("x^y")), "x^y")
+        self.assertEqual(plain_text("a^b"), "a^b")
+
 
 class BarElementTest(unittest.TestCase):
     def test_fixed_size(self):
@@ -150,6 +230,24 @@ class BarElementTest(unittest.TestCase):
             self.fail('error in unicode handling')
 
 
+class ViewTest(unittest.TestCase):
+    def setUp(self):
+        self.elm = BarElement(dict(colour=ForegroundColour("red")))
+        self.elm.update = lambda: "value"
+
+    def test_own_layout(self):
+        view = View(self.elm, size=3, scroll=1, colour=ForegroundColour("b"))
+        self.assertEqual(view.next(), "^fg(b)val^fg()")
+        self.assertEqual(view.next(), "^fg(b)alu^fg()")
+        self.assertEqual(self.elm.next(), "^fg(red)value^fg()")
+
+    def test_stale(self):
+        view = View(self.elm)
+        self.assertEqual(view.render("value", stale=True),
+                "^fg(darkgrey)value^fg()")
+        self.assertEqual(view.render("value"), "^fg(red)value^fg()")
+
+
 class IconTest(unittest.TestCase):
     def setUp(self):
         with warnings.catch_warnings():
@@ -178,6 +276,27 @@ class IconTest(unittest.TestCase):
         else:
             self.fail("failed file check!")
 
+    def test_cached(self):
+        icons = Icon(self.ico_basedir)
+        self.assertTrue(icons[self.ico_name] is icons[self.ico_name])
+
+    def test_dir_change(self):
+        icons = Icon(self.ico_basedir, recheck=0)
+        first = icons[self.ico_name]
+        os.utime(self.ico_basedir, (0, 0))
+        self.assertFalse(icons[self.ico_name] is first)
+        self.assertEqual(icons[self.ico_name], first)
+
+    def test_validate(self):
+        icons = Icon(self.ico_basedir)
+        icons.validate(self.ico_name)
+        try:
+            icons.validate(self.ico_name, "nope1.xbm", "nope2.xbm")
+        except IOError as e:
+            self.assertTrue("nope1.xbm, nope2.xbm" in str(e))
+        else:
+            self.fail("missing icons not reported")
+
     def test_fail_nobasedir(self):
         try:
             icons = Icon("dir_shall_not_exists")
@@ -187,6 +306,1679 @@ class IconTest(unittest.TestCase):
             self.fail("failed directory check!")
         
 
+class TemplateTest(unittest.TestCase):
+    def test_render(self):
+        tpl = Template(" {0:.1f}^{name}", icon=DzenString(("i", "ico")),
+                colour=ForegroundColour("red"))
+        self.assertEqual(tpl(0.25, name="x^"), "^fg(red)^i(ico) 0.2^^x^^^fg()")
+
+    def test_unchanged_is_cached(self):
+        tpl = Template("{0} {1}")
+        first = tpl(1, 2)
+        self.assertTrue(tpl(1, 2) is first)
+        self.assertEqual(tpl(1, 3), "1 3")
+        self.assertEqual(tpl(1.0, 3), "1.0 3")
+
+    def test_only_changed_fields(self):
+        formatted = []
+        class Spy(object):
+            def __init__(self, val):
+                self.val = val
+            def __eq__(self, other):
+                return self.val == other.val
+            def __format__(self, spec):
+                formatted.append(self.val)
+                return str(self.val)
+        tpl = Template("{a}-{b}")
+        self.assertEqual(tpl(a=Spy(1), b=Spy(2)), "1-2")
+        self.assertEqual(tpl(a=Spy(1), b=Spy(3)), "1-3")
+        self.assertEqual(formatted, [1, 2, 3])
+
+    def test_element_cache(self):
+        tpl = Template("{0}", colour=ForegroundColour("c"))
+        elm = BarElement(dict(colour=ForegroundColour("blue")))
+        elm.update = lambda: tpl(7)
+        first = elm.next()
+        self.assertEqual(first, "^fg(blue)^fg(c)7^fg()^fg()")
+        self.assertTrue(elm.next() is first)
+
+    def test_colour_cache(self):
+        col = ForegroundColour("c")
+        part = DzenString("x")
+        self.assertTrue(col(part) is col(part))
+        self.assertFalse(col(part) is col(DzenString("x")))
+
+
+class HistoryTest(unittest.TestCase):
+    def test_wraps(self):
+        history = History(3)
+        for value in range(5):
+            history.append(value)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(list(history), [2.0, 3.0, 4.0])
+
+    def test_partial(self):
+        history = History(4)
+        history.append(1)
+        self.assertEqual(len(history), 1)
+        self.assertEqual(list(history), [1.0])
+
+
+class GraphTest(unittest.TestCase):
+    def test_fixed_scale(self):
+        graph = Graph(3, height=4, high=1.0)
+        self.assertEqual(graph.push(1.0),
+                "^p(1)^p(1)^p(;0)^r(1x4)^p()")
+        self.assertEqual(graph.push(0.5),
+                "^p(1)^p(;0)^r(1x4)^p(;1)^r(1x2)^p()")
+        graph.push(0.0)
+        self.assertEqual(graph.push(2.0),
+                "^p(;1)^r(1x2)^p(1)^p(;0)^r(1x4)^p()")
+
+    def test_columns_shared(self):
+        graph = Graph(2, height=4, high=1.0)
+        graph.push(0.5)
+        graph.push(0.5)
+        self.assertTrue(graph.columns[0] is graph.columns[1])
+
+    def test_autoscale(self):
+        graph = Graph(3, height=4)
+        graph.push(1.0)
+        self.assertEqual(graph.push(2.0),
+                "^p(1)^p(;1)^r(1x2)^p(;0)^r(1x4)^p()")
+        self.assertEqual(graph.push(1.0),
+                "^p(;1)^r(1x2)^p(;0)^r(1x4)^p(;1)^r(1x2)^p()")
+        graph.push(1.0)
+        # the maximum leaves the history, columns are scaled again
+        self.assertEqual(graph.push(1.0),
+                "^p(;0)^r(1x4)^p(;0)^r(1x4)^p(;0)^r(1x4)^p()")
+
+    def test_autoscale_follows_window(self):
+        graph = Graph(5, height=4)
+        values = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5, 8, 9, 7, 9, 3, 2, 3, 8,
+                4, 6, 2, 6, 4, 3, 3, 8, 3, 2, 7, 9, 5, 0, 2, 8, 8, 4, 1]
+        for i, value in enumerate(values):
+            graph.push(value)
+            self.assertEqual(graph._scale, max(values[max(0, i - 4):i + 1]))
+        self.assertTrue(len(graph._maxima) <= 5)
+
+
+class ElementStatsTest(unittest.TestCase):
+    def test_record(self):
+        stats = ElementStats()
+        stats.record(0.0005)
+        stats.record(0.002)
+        stats.record(0.002, "Error()")
+        stats.record(10)
+        self.assertEqual(stats.histogram, [1, 2, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual((stats.calls, stats.errors), (4, 1))
+        self.assertEqual(stats.max, 10)
+        self.assertTrue("<1ms:1 <5ms:2 >=5000ms:1" in str(stats))
+        self.assertTrue(str(stats).endswith("last_error=Error()"))
+
+    def test_element_counters(self):
+        class TestElement(BarElement):
+            event = True
+            def update(self):
+                if self.event:
+                    raise StandardError
+                return "ok"
+            def check_update(self):
+                return self.event
+        elm = TestElement()
+        elm.next()
+        elm.event = False
+        elm.next()
+        elm.next()
+        self.assertEqual((elm.stats.calls, elm.stats.errors, elm.stats.skips),
+                (1, 1, 2))
+        self.assertEqual(elm.stats.last_success, None)
+
+    def test_dump(self):
+        elm = BarElement()
+        elm.update = lambda: "x"
+        sched = Scheduler((elm,))
+        sched.tick(0)
+        out = StringIO.StringIO()
+        sched.dump_stats(out)
+        self.assertTrue(out.getvalue().startswith(
+            " 0 BarElement     calls=1 skips=0 errors=0 stale=0"))
+
+
+class FakeClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.now += delay
+
+
+class SchedulerTest(unittest.TestCase):
+    def counter(self, interval):
+        def updatefunc(static=[0]):
+            static[0] += 1
+            return str(static[0])
+        elm = BarElement(interval=interval)
+        elm.update = updatefunc
+        return elm
+
+    def test_align(self):
+        self.assertEqual(align(0.3, 1), 1.0)
+        self.assertEqual(align(1.0, 1), 2.0)
+        self.assertEqual(align(61.7, 60), 120.0)
+        self.assertEqual(align(0.3, 0.25), 0.5)
+
+    def test_intervals(self):
+        clock = FakeClock(0.5)
+        fast, slow = self.counter(1), self.counter(5)
+        lines = iter(Scheduler((fast, slow), clock, clock.sleep))
+        self.assertEqual(next(lines), ["1", "1"])
+        self.assertEqual(next(lines), ["2", "1"])
+        self.assertEqual(clock.now, 1.0)
+        for i in range(3):
+            next(lines)
+        self.assertEqual(next(lines), ["6", "2"])
+        self.assertEqual(clock.now, 5.0)
+
+    def test_change_only(self):
+        clock = FakeClock(0.5)
+        elm = BarElement()
+        elm.update = lambda: "same"
+        sched = Scheduler((elm,), clock, clock.sleep)
+        self.assertTrue(sched.tick(clock()))
+        clock.sleep(1)
+        self.assertFalse(sched.tick(clock()))
+
+    def test_slow_update_keeps_alignment(self):
+        clock = FakeClock(0.0)
+        elm = BarElement()
+        def slowfunc():
+            clock.sleep(0.3)
+            return str(clock())
+        elm.update = slowfunc
+        lines = iter(Scheduler((elm,), clock, clock.sleep))
+        next(lines)
+        self.assertEqual(next(lines), [str(1.3)])
+        self.assertEqual(next(lines), [str(2.3)])
+
+    def test_timers(self):
+        clock = FakeClock(0.5)
+        fired = []
+        sched = Scheduler((self.counter(10),), clock, clock.sleep)
+        sched.at(3.25, lambda: fired.append(clock()))
+        sched.at(2.0, lambda: fired.append(clock()))
+        lines = iter(sched)
+        next(lines)
+        sched.elements[0].update = lambda: "2" if fired[1:] else "1"
+        self.assertEqual(next(lines), ["2"])
+        self.assertEqual(fired, [2.0, 3.25])
+        self.assertEqual(clock.now, 10.0)
+
+    def test_shared_element(self):
+        clock = FakeClock(0.5)
+        elm = self.counter(1)
+        wide = View(elm, size=4)
+        sched = Scheduler((elm, wide, elm), clock, clock.sleep)
+        self.assertEqual(sched.elements, [elm])
+        lines = iter(sched)
+        self.assertEqual(next(lines), ["1", "   1", "1"])
+        self.assertEqual(next(lines), ["2", "   2", "2"])
+
+    def test_reconfigure(self):
+        clock = FakeClock(0.5)
+        kept, dropped, new = self.counter(5), self.counter(5), self.counter(5)
+        sched = Scheduler((kept, dropped), clock, clock.sleep)
+        self.assertTrue(sched.tick(clock()))
+        sched.reconfigure((new, kept))
+        self.assertTrue(sched.tick(clock()))
+        self.assertEqual(sched.values, ["1", "1"])
+        self.assertEqual(sched.due, [5.0, 5.0])
+        sched.reconfigure((kept,))
+        self.assertTrue(sched.tick(clock()))
+        self.assertEqual(sched.values, ["1"])
+
+    def test_stop(self):
+        clock = FakeClock()
+        elm = BarElement()
+        elm.update = lambda static=["1", None]: static.pop(0)
+        lines = Scheduler((elm,), clock, clock.sleep)
+        self.assertEqual(list(lines), [["1"]])
+
+    def test_watch(self):
+        sched = Scheduler((self.counter(1),))
+        read, write = os.pipe()
+        called = []
+        sched.watch(read, called.append)
+        os.write(write, "x")
+        sched.wait(1)
+        self.assertEqual(called, [read])
+        sched.unwatch(read)
+        sched.wait(0)
+        self.assertEqual(called, [read])
+        os.close(read)
+        os.close(write)
+
+
+class WakeupTest(unittest.TestCase):
+    def test_set_clear(self):
+        wakeup = Wakeup()
+        ready = lambda: select.select([wakeup], [], [], 0)[0]
+        self.assertFalse(ready())
+        for i in range(100000):
+            wakeup.set()
+        self.assertTrue(ready())
+        wakeup.clear()
+        self.assertFalse(ready())
+
+    def test_push_element(self):
+        class Pushed(PushMixin, BarElement):
+            INTERVAL = 60
+            count = 0
+            def update(self):
+                self.count += 1
+                return str(self.count)
+        elm = Pushed()
+        sched = Scheduler((elm,))
+        lines = iter(sched)
+        self.assertEqual(next(lines), ["1"])
+        # due again, but nothing was pushed
+        sched.due[0] = 0
+        self.assertFalse(sched.tick(time.time()))
+        timer = threading.Timer(0.05, elm.push)
+        timer.start()
+        start = time.time()
+        self.assertEqual(next(lines), ["2"])
+        self.assertTrue(time.time() - start < 1)
+        timer.join()
+        fd = elm.wakeup.fileno()
+        elm.stop()
+        self.assertRaises(OSError, os.fstat, fd)
+
+
+class UpdatePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = UpdatePool(2)
+        self.release = threading.Event()
+        self.values = ["fast", "slow"]
+        def blocking_update():
+            ret = self.values.pop(0)
+            if ret == "slow":
+                self.release.wait()
+            return ret
+        self.elm = BarElement(timeout=0.01)
+        self.elm.update = blocking_update
+        self.elm.pool = self.pool
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_result(self):
+        self.assertEqual(self.elm.next(), "fast")
+        self.assertFalse(self.elm.stale)
+
+    def test_stale_on_deadline(self):
+        self.elm.next()
+        self.assertEqual(self.elm.next(), "^fg(darkgrey)fast^fg()")
+        self.assertTrue(self.elm.stale)
+        self.release.set()
+        self.elm.job.done.wait(1)
+        self.assertEqual(self.elm.next(), "slow")
+        self.assertFalse(self.elm.stale)
+
+    def test_no_resubmit_while_running(self):
+        self.elm.next()
+        self.elm.next()
+        job = self.elm.job
+        self.elm.next()
+        self.assertTrue(self.elm.job is job)
+        self.assertEqual(self.values, [])
+
+    def test_error_keeps_worker(self):
+        class Error(Exception):
+            pass
+        def failing():
+            raise Error("x")
+        self.elm.update = failing
+        self.assertEqual(self.elm.next(), "Error('x',)")
+        job = self.pool.submit(failing)
+        self.assertTrue(job.wait(1))
+        self.assertEqual(job.result, "Error('x',)")
+        self.assertTrue(all(worker.is_alive()
+            for worker in self.pool.workers))
+
+    def test_scheduler_waits_once(self):
+        slow = BarElement(timeout=0.05)
+        slow.update = lambda: self.release.wait() and "never"
+        other = BarElement(timeout=0.05)
+        other.update = lambda: self.release.wait() and "never"
+        clock = FakeClock()
+        sched = Scheduler((slow, other), clock, clock.sleep, pool=self.pool)
+        start = time.time()
+        sched.tick(clock())
+        self.assertTrue(time.time() - start < 0.09)
+        self.assertTrue(slow.stale and other.stale)
+
+
+class MountTableTest(unittest.TestCase):
+    MOUNTINFO = (
+        "22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n"
+        "40 22 8:2 / /mnt/my\\040disk rw shared:2 - ext4 /dev/sda2 rw\n")
+
+    def setUp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.path = os.tmpnam()
+        with open(self.path, "w") as f:
+            f.write(self.MOUNTINFO)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parse(self):
+        table = MountTable(self.path)
+        self.assertEqual(table.mounts, frozenset(["/", "/mnt/my disk"]))
+        self.assertTrue("/mnt/my disk" in table)
+        self.assertFalse("/media/usbstick" in table)
+
+    def test_no_reread_without_event(self):
+        table = MountTable(self.path)
+        with open(self.path, "a") as f:
+            f.write("41 22 8:3 / /media/usbstick rw - vfat /dev/sdb1 rw\n")
+        self.assertFalse(table.check())
+        self.assertFalse("/media/usbstick" in table)
+        table.reload()
+        self.assertTrue("/media/usbstick" in table)
+
+
+class ProcFileTest(unittest.TestCase):
+    def setUp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.path = os.tmpnam()
+        self.write("MemTotal:       16318772 kB\nMemFree:  123 kB\n"
+                   "charging state:          discharging\nLast: 7")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def test_values(self):
+        reader = ProcFile(self.path, ("MemFree", "MemTotal", "charging state"))
+        self.assertEqual(reader.values(), ["123", "16318772", "discharging"])
+
+    def test_last_line(self):
+        self.assertEqual(ProcFile(self.path, ("Last",)).values(), ["7"])
+
+    def test_missing_key(self):
+        reader = ProcFile(self.path, ("Committed_AS",))
+        self.assertRaises(KeyError, reader.values)
+
+    def test_reread_and_grow(self):
+        reader = ProcFile(self.path, ("MemFree", "Padding"), bufsize=8)
+        self.write("MemFree: 1\n")
+        self.assertRaises(KeyError, reader.values)
+        self.write("MemFree: 42\n" + "x" * 100 + "\nPadding: 9\n")
+        self.assertEqual(reader.values(), ["42", "9"])
+        self.assertTrue(len(reader.buf) >= reader.size)
+
+
+class DzenOutputTest(unittest.TestCase):
+    def setUp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.path = os.tmpnam()
+        self.clock = FakeClock(100)
+        self.timers = []
+        self.out = DzenOutput("cat > " + self.path, budget=1,
+                schedule=lambda when, func: self.timers.append((when, func)),
+                clock=self.clock)
+
+    def tearDown(self):
+        self.out.stop()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def written(self):
+        self.out.proc.stdin.close()
+        self.out.proc.wait()
+        with open(self.path) as f:
+            return f.read()
+
+    def test_close_writes_pending(self):
+        self.out.write("1")
+        self.out.write("2")
+        self.out.close()
+        self.assertTrue(self.out.proc is None)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "1\n2\n")
+
+    def test_change_only(self):
+        for line in ("a", "a", "b", "b", "a"):
+            self.out.write(line)
+            self.clock.sleep(2)
+        self.assertEqual(self.written(), "a\nb\na\n")
+
+    def test_coalesce(self):
+        for line in ("a", "b", "c", "d"):
+            self.out.write(line)
+        self.assertEqual(len(self.timers), 1)
+        when, func = self.timers.pop()
+        self.assertEqual(when, 101)
+        self.clock.now = when
+        func()
+        self.assertEqual(self.timers, [])
+        self.assertEqual(self.written(), "a\nd\n")
+
+    def test_restart(self):
+        self.out.write("a")
+        first = self.out.proc
+        first.terminate()
+        first.wait()
+        self.clock.sleep(2)
+        self.out.write("b")
+        self.assertFalse(self.out.proc is first)
+        self.assertEqual(self.written(), "b\n")
+
+    def test_restart_backoff(self):
+        self.out.command = "head -n 1 >/dev/null"
+        self.out.budget = 0
+        self.out.write("a")
+        for delay in (0, 1, 2, 4):
+            self.out.proc.wait()
+            self.out.write(self.out.last + "x")
+            if delay:
+                self.assertTrue(self.out.proc is None)
+                when, func = self.timers.pop()
+                self.assertEqual(when, self.clock() + delay)
+                self.clock.now = when
+                func()
+            self.assertFalse(self.out.proc is None)
+        # a command running long enough is restarted right away again
+        self.out.proc.wait()
+        self.clock.sleep(60)
+        self.out.write("b")
+        self.assertFalse(self.out.proc is None)
+
+    def test_no_blocking(self):
+        self.out.command = "sleep 10"
+        big = "x" * 300000
+        start = time.time()
+        self.out.write(big + "1")
+        self.clock.sleep(2)
+        self.out.write(big + "2")
+        self.out.write(big + "3")
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(self.out.buffer.endswith("1\n"))
+        self.assertEqual(self.out.pending, big + "3")
+
+
+class MultiOutputTest(unittest.TestCase):
+    def test_slices(self):
+        first, second = Mock(), Mock()
+        output = MultiOutput([(first, 2), (second, 1)])
+        output.write(["a", "b", "c"])
+        first.write.assert_called_once_with("a b")
+        second.write.assert_called_once_with("c")
+
+    def test_set_bars(self):
+        first, second = Mock(), Mock()
+        output = MultiOutput([(first, 1), (second, 1)])
+        output.set_bars([(second, 2)])
+        first.stop.assert_called_once_with()
+        self.assertFalse(second.stop.called)
+        output.write(["a", "b"])
+        second.write.assert_called_once_with("a b")
+
+
+class NotificationStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(100)
+        self.closed = []
+        self.store = notification.NotificationStore(size=3,
+                default_timeout=10, rate=(3, 60),
+                closed=lambda *args: self.closed.append(args),
+                clock=self.clock)
+
+    def rotation(self, count):
+        return [self.store.next() for i in range(count)]
+
+    def test_rotation_by_urgency(self):
+        self.store.add(1, "low", urgency=notification.LOW)
+        self.store.add(2, "normal")
+        self.store.add(3, "critical", urgency=notification.CRITICAL)
+        self.assertEqual(self.rotation(4),
+                ["critical", "normal", "low", "critical"])
+
+    def test_replace_in_place(self):
+        self.store.add(1, "one")
+        self.store.add(2, "two")
+        self.store.add(1, "uno")
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.rotation(2), ["uno", "two"])
+
+    def test_bounded(self):
+        for i in range(1, 5):
+            self.store.add(i, str(i), app_name=str(i))
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.closed, [(1, notification.UNDEFINED)])
+        self.store.add(5, "crit", urgency=notification.CRITICAL)
+        self.assertEqual(self.closed[-1], (2, notification.UNDEFINED))
+
+    def test_expire(self):
+        self.store.add(1, "default")
+        self.store.add(2, "short", expire_timeout=2000)
+        self.store.add(3, "forever", expire_timeout=0)
+        self.clock.sleep(5)
+        self.store.expire()
+        self.assertEqual(self.closed, [(2, notification.EXPIRED)])
+        self.clock.sleep(5)
+        self.store.expire()
+        self.assertEqual(self.rotation(2), ["forever", "forever"])
+
+    def test_rate_limit(self):
+        for i in range(5):
+            self.store.add(i + 1, "spam", app_name="chatty")
+        self.assertFalse(self.store.add(9, "spam", app_name="chatty"))
+        self.assertTrue(self.store.add(1, "again", app_name="chatty"))
+        self.assertTrue(self.store.add(10, "other", app_name="quiet"))
+        self.clock.sleep(61)
+        self.assertTrue(self.store.add(11, "spam", app_name="chatty"))
+
+    def test_close_and_clear(self):
+        self.store.add(1, "one")
+        self.store.add(2, "two")
+        self.store.close(1)
+        self.store.close(42)
+        self.assertEqual(self.closed, [(1, notification.CLOSED)])
+        self.store.clear()
+        self.assertEqual(self.closed[-1], (2, notification.DISMISSED))
+        self.assertEqual(self.store.next(), None)
+
+
+def fake_dbus_modules(emitted):
+    '''dbus, dbus.service and gobject standing for the real ones: methods
+    are plain methods, signals append (name, args) to emitted'''
+    service = types.ModuleType("dbus.service")
+    class Object(object):
+        def __init__(self, bus, path):
+            self.bus, self.path = bus, path
+            self.connected = True
+        def remove_from_connection(self):
+            self.connected = False
+    def method(*args, **kwargs):
+        return lambda func: func
+    def signal(*args, **kwargs):
+        def decorator(func):
+            def emit(self, *args):
+                emitted.append((func.__name__, args))
+            return emit
+        return decorator
+    service.Object, service.method, service.signal = Object, method, signal
+    service.BusName = Mock()
+    dbus = types.ModuleType("dbus")
+    dbus.service = service
+    gobject = types.ModuleType("gobject")
+    gobject.idle_add = lambda func, *args: func(*args)
+    return {"dbus": dbus, "dbus.service": service, "gobject": gobject}
+
+
+class NotificationTest(unittest.TestCase):
+    def setUp(self):
+        self.emitted = []
+        with patch.dict(sys.modules, fake_dbus_modules(self.emitted)):
+            self.elm = notification.Notification(dict(bus=Mock()))
+        self.fetcher = self.elm._nf
+
+    def notify(self, notification_id, summary, urgency=notification.NORMAL):
+        return self.fetcher.Notify("app", notification_id, "", summary,
+                "body", [], {"urgency": urgency}, -1)
+
+    def woken(self):
+        ready = select.select(self.elm.wakeup_fds(), [], [], 0)[0]
+        for fd in ready:
+            self.elm.handle_wakeup(fd)
+        return bool(ready)
+
+    def test_notify(self):
+        self.assertEqual(self.elm.sample(), " ")
+        self.assertEqual(self.notify(0, "first"), 1)
+        self.assertEqual(self.notify(0, "second", notification.CRITICAL), 2)
+        self.assertTrue(self.woken())
+        self.assertEqual(self.elm.sample(), "second body")
+        self.assertEqual(self.elm.sample(), "first body")
+        # a known id replaces the notification in place
+        self.assertEqual(self.notify(1, "again"), 1)
+        self.assertEqual(self.elm.sample(), "second body")
+        self.assertEqual(self.elm.sample(), "again body")
+        self.assertEqual(self.emitted, [])
+
+    def test_close(self):
+        self.notify(0, "first")
+        self.elm.sample()
+        self.fetcher.CloseNotification(1)
+        self.assertTrue(self.woken())
+        self.assertEqual(self.elm.sample(), " ")
+        self.assertEqual(self.emitted,
+                [("NotificationClosed", (1, notification.CLOSED))])
+
+    def test_stop(self):
+        fd = self.elm.wakeup.fileno()
+        self.elm.stop()
+        self.assertFalse(self.fetcher.connected)
+        self.assertRaises(OSError, os.fstat, fd)
+
+class ReconnectingWatcherTest(unittest.TestCase):
+    def test_stop_while_connecting(self):
+        connecting = threading.Event()
+        connected = threading.Event()
+        conn = Mock()
+        watched = []
+        class Watcher(ReconnectingWatcher):
+            def connect(self):
+                connecting.set()
+                connected.wait(5)
+                return conn
+            def watch(self, conn):
+                watched.append(conn)
+        watcher = Watcher()
+        self.assertTrue(connecting.wait(5))
+        started = time.time()
+        watcher.stop(timeout=0.05)
+        self.assertTrue(time.time() - started < 1)
+        connected.set()
+        watcher._thread.join(5)
+        self.assertFalse(watcher._thread.is_alive())
+        conn.close.assert_called_once_with()
+        self.assertEqual(watcher.conn, None)
+        self.assertEqual(watched, [])
+
+
+class FakeMpd(object):
+    '''in-process server speaking just enough of the MPD protocol'''
+    def __init__(self):
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        self.song = {"Artist": "Foo", "Title": "Bar"}
+        # bumped by every change, so that an idle started after it still
+        # sees it
+        self.generation = 0
+        self.changed = threading.Condition()
+        self.conns = []
+        self.commands = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn = self.server.accept()[0]
+            except socket.error:
+                return
+            self.conns.append(conn)
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        stream = conn.makefile('rb')
+        seen = self.generation
+        try:
+            conn.sendall("OK MPD 0.21.0\n")
+            for line in iter(stream.readline, ''):
+                self.commands.append(line.strip())
+                if line.startswith("currentsong"):
+                    with self.changed:
+                        seen, song = self.generation, self.song
+                    conn.sendall("".join("{0}: {1}\n".format(*item)
+                            for item in song.items()) + "OK\n")
+                elif line.startswith("idle"):
+                    with self.changed:
+                        while self.generation == seen:
+                            self.changed.wait()
+                    conn.sendall("changed: player\nOK\n")
+                else:
+                    conn.sendall("ACK [5@0] {} unknown command\n")
+        except socket.error:
+            pass
+
+    def change(self, **song):
+        with self.changed:
+            self.song = song
+            self.generation += 1
+            self.changed.notify_all()
+
+    def drop(self):
+        for conn in self.conns:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+        self.conns = []
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+
+    def close(self):
+        self.server.close()
+        self.drop()
+
+
+class MpdWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.mpd = FakeMpd()
+        self.event = threading.Event()
+        self.watcher = MpdWatcher("127.0.0.1", self.mpd.port,
+                changed=self.event.set, backoff=(0.01, 0.05))
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.mpd.close()
+
+    def wait_song(self, song):
+        for i in range(100):
+            self.event.wait(1)
+            self.event.clear()
+            if self.watcher.song == song:
+                return
+        self.fail("song not updated: {0!r}".format(self.watcher.song))
+
+    def test_idle_updates(self):
+        self.wait_song({"Artist": "Foo", "Title": "Bar"})
+        self.mpd.change(Title="Baz")
+        self.wait_song({"Title": "Baz"})
+        self.assertEqual(self.mpd.commands.count("currentsong"), 2)
+        self.assertTrue('idle "player"' in self.mpd.commands)
+
+    def test_keepalive(self):
+        conn = MpdConnection("127.0.0.1", self.mpd.port)
+        self.addCleanup(conn.close)
+        self.assertTrue(conn.sock.getsockopt(socket.SOL_SOCKET,
+            socket.SO_KEEPALIVE))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            self.assertEqual(conn.sock.getsockopt(socket.IPPROTO_TCP,
+                socket.TCP_KEEPIDLE), 60)
+
+    def test_reconnect(self):
+        self.wait_song({"Artist": "Foo", "Title": "Bar"})
+        self.mpd.song = {"Title": "After"}
+        self.mpd.drop()
+        self.wait_song({"Title": "After"})
+
+
+class FakeImap(object):
+    '''in-process server speaking just enough IMAP for IDLE'''
+    def __init__(self, idle=True):
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        self.idle = idle
+        self.unseen = [1, 2]
+        # bumped by every change, so that an IDLE started after it still
+        # sees it
+        self.generation = 0
+        self.changed = threading.Condition()
+        self.conns = []
+        self.commands = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn = self.server.accept()[0]
+            except socket.error:
+                return
+            self.conns.append(conn)
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        stream = conn.makefile('rb')
+        seen = self.generation
+        caps = "IMAP4rev1 IDLE" if self.idle else "IMAP4rev1"
+        try:
+            conn.sendall("* OK fake IMAP ready\r\n")
+            for line in iter(stream.readline, ''):
+                tag, command = line.split(" ", 1)
+                command = command.strip()
+                self.commands.append(command)
+                if command.startswith("LOGIN"):
+                    if command != 'LOGIN "me" "se\\"cret"':
+                        conn.sendall(tag + " NO wrong password\r\n")
+                        continue
+                elif command == "CAPABILITY":
+                    conn.sendall("* CAPABILITY " + caps + "\r\n")
+                elif command.startswith("EXAMINE"):
+                    conn.sendall("* 3 EXISTS\r\n")
+                elif command == "SEARCH UNSEEN":
+                    with self.changed:
+                        seen, unseen = self.generation, self.unseen
+                    conn.sendall("* SEARCH" + "".join(" {0}".format(n)
+                        for n in unseen) + "\r\n")
+                elif command == "IDLE":
+                    conn.sendall("+ idling\r\n")
+                    with self.changed:
+                        while self.generation == seen:
+                            self.changed.wait()
+                    conn.sendall("* 4 EXISTS\r\n")
+                    stream.readline()
+                conn.sendall(tag + " OK done\r\n")
+        except socket.error:
+            pass
+
+    def change(self, unseen):
+        with self.changed:
+            self.unseen = unseen
+            self.generation += 1
+            self.changed.notify_all()
+
+    def drop(self):
+        for conn in self.conns:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+        self.conns = []
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+
+    def close(self):
+        self.server.close()
+        self.drop()
+
+
+class ImapWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.imap = FakeImap()
+        self.event = threading.Event()
+
+    def tearDown(self):
+        self.imap.close()
+
+    def watch(self, **kwargs):
+        watcher = ImapWatcher.shared(self.event.set, host="127.0.0.1",
+                port=self.imap.port, user="me", password='se"cret',
+                use_ssl=False, backoff=(0.01, 0.05), **kwargs)
+        self.addCleanup(watcher.release, self.event.set)
+        return watcher
+
+    def wait_unseen(self, watcher, unseen):
+        for i in range(100):
+            self.event.wait(1)
+            self.event.clear()
+            if watcher.unseen == unseen:
+                return
+        self.fail("count not updated: {0!r}".format(watcher.error))
+
+    def test_idle_updates(self):
+        watcher = self.watch()
+        self.wait_unseen(watcher, 2)
+        self.imap.change([1, 2, 4])
+        self.wait_unseen(watcher, 3)
+        self.assertEqual(self.imap.commands.count('LOGIN "me" "se\\"cret"'),
+                1)
+        self.assertTrue("IDLE" in self.imap.commands)
+
+    def test_reconnect(self):
+        watcher = self.watch()
+        self.wait_unseen(watcher, 2)
+        self.imap.unseen = []
+        self.imap.drop()
+        self.wait_unseen(watcher, 0)
+
+    def test_poll_without_idle(self):
+        self.imap.idle = False
+        watcher = self.watch(poll=0.01)
+        self.wait_unseen(watcher, 2)
+        self.imap.unseen = [5]
+        self.wait_unseen(watcher, 1)
+        self.assertFalse("IDLE" in self.imap.commands)
+
+    def test_failed_login_closes(self):
+        socks = []
+        def create_connection(*args):
+            socks.append(real_create_connection(*args))
+            return socks[-1]
+        real_create_connection = socket.create_connection
+        with patch("socket.create_connection", create_connection):
+            self.assertRaises(ImapError, ImapConnection, "127.0.0.1",
+                    self.imap.port, user="me", password="wrong",
+                    use_ssl=False)
+        self.assertRaises(socket.error, socks[0].fileno)
+
+    def test_shared_per_account(self):
+        first = self.watch()
+        listener = Mock()
+        second = ImapWatcher.shared(listener, host="127.0.0.1",
+                port=self.imap.port, user="me", password='se"cret',
+                use_ssl=False, backoff=(0.01, 0.05))
+        self.assertTrue(first is second)
+        second.release(listener)
+        self.assertFalse(first._stop.is_set())
+
+    def test_element(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("host: 127.0.0.1\nport: {0}\nuser: me\n"
+                "password: se\"cret\nssl: no\n".format(self.imap.port))
+        self.addCleanup(os.remove, path)
+        elm = IMAPRecent({'acct-file': path, 'cmd': "mutt"})
+        self.addCleanup(elm.stop)
+        self.assertTrue(select.select(elm.wakeup_fds(), [], [], 5)[0])
+        elm.handle_wakeup(elm.wakeup_fds()[0])
+        for i in range(100):
+            if elm.watcher.unseen is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(elm.next(), "^ca(1,mutt)mail: 2^ca()")
+
+
+class FakeBus(object):
+    '''stands for a dbus.SessionBus, counting the calls made on it'''
+    def __init__(self, players):
+        self.players = players
+        self.signals = {}
+        self.calls = 0
+
+    def add_signal_receiver(self, handler, signal_name, *args, **kwargs):
+        self.signals[signal_name] = handler
+        match = Mock()
+        match.remove.side_effect = lambda: self.signals.pop(signal_name)
+        return match
+
+    def list_names(self):
+        self.calls += 1
+        return ["org.freedesktop.DBus"] + list(self.players)
+
+    def get_name_owner(self, name):
+        self.calls += 1
+        return self.players[name][0]
+
+    def get_object(self, name, path):
+        bus = self
+        class Proxy(object):
+            def GetAll(self, interface, dbus_interface, reply_handler,
+                    error_handler):
+                bus.calls += 1
+                reply_handler(bus.players[name][1])
+        return Proxy()
+
+
+class Mpris2PlayerTest(unittest.TestCase):
+    VLC = "org.mpris.MediaPlayer2.vlc"
+
+    def setUp(self):
+        self.bus = FakeBus({self.VLC: (":1.5", {"PlaybackStatus": "Playing",
+            "Metadata": {"xesam:title": "Song", "xesam:artist": ["Band"]}})})
+        self.elm = Mpris2Player(dict(bus=self.bus))
+
+    def changed(self, sender, props):
+        self.bus.signals["PropertiesChanged"](
+                "org.mpris.MediaPlayer2.Player", props, [], sender=sender)
+
+    def shown(self):
+        '''the value after the scheduler handled the pushed changes'''
+        for fd in select.select(self.elm.wakeup_fds(), [], [], 0)[0]:
+            self.elm.handle_wakeup(fd)
+        return self.elm.next()
+
+    def test_initial(self):
+        self.assertEqual(self.elm.next(), "Band - Song")
+
+    def test_cached(self):
+        calls = self.bus.calls
+        for i in range(10):
+            self.elm.next()
+        self.assertEqual(self.bus.calls, calls)
+
+    def test_properties_changed(self):
+        self.elm.next()
+        self.changed(":1.5", {"Metadata": {"xesam:title": "Other"}})
+        self.assertEqual(self.shown(), "Other")
+        self.changed(":1.5", {"PlaybackStatus": "Stopped"})
+        self.assertEqual(self.shown(), "Not Playing")
+        self.changed(":1.9", {"PlaybackStatus": "Playing"})
+        self.assertEqual(self.shown(), "Not Playing")
+
+    def test_players_come_and_go(self):
+        owner_changed = self.bus.signals["NameOwnerChanged"]
+        self.elm.next()
+        owner_changed(self.VLC, ":1.5", "")
+        self.assertEqual(self.shown(), "Not Playing")
+        self.bus.players["org.mpris.MediaPlayer2.mpv"] = (":1.7", {
+            "PlaybackStatus": "Playing", "Metadata": {"xesam:title": "Mpv"}})
+        owner_changed("org.mpris.MediaPlayer2.mpv", "", ":1.7")
+        owner_changed("org.example.Other", "", ":1.8")
+        self.assertTrue(select.select([self.elm.wakeup], [], [], 0)[0])
+        self.assertEqual(self.shown(), "Mpv")
+        # nothing pushed, nothing updated
+        self.elm.update = Mock()
+        self.assertEqual(self.elm.next(), "Mpv")
+        self.assertFalse(self.elm.update.called)
+
+    def test_stop(self):
+        fd = self.elm.wakeup.fileno()
+        self.elm.stop()
+        self.assertEqual(self.bus.signals, {})
+        self.assertRaises(OSError, os.fstat, fd)
+
+
+class StatSamplerTest(unittest.TestCase):
+    STAT = ("cpu  {0} 0 {0} {1} 0 0 0 0 0 0\n"
+            "cpu0 {0} 0 0 {1} 0 0 0 0 0 0\n"
+            "cpu1 0 0 {0} {1} 0 0 0 0 0 0\n"
+            "intr 1 2 3\nctxt 42\n")
+    NETDEV = ("Inter-|   Receive |  Transmit\n"
+              " face |bytes packets|bytes packets\n"
+              "    lo: {0} 1 0 0 0 0 0 0 {0} 1 0 0 0 0 0 0\n"
+              "  eth0: {1} 1 0 0 0 0 0 0 {2} 1 0 0 0 0 0 0\n")
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stat = os.path.join(self.dir, "stat")
+        self.netdev = os.path.join(self.dir, "netdev")
+        self.write(100, 100, 0, 0, 0)
+        self.clock = FakeClock(10)
+        self.sampler = StatSampler(2, self.stat, self.netdev, self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, busy, idle, lo, rx, tx):
+        with open(self.stat, "w") as f:
+            f.write(self.STAT.format(busy, idle))
+        with open(self.netdev, "w") as f:
+            f.write(self.NETDEV.format(lo, rx, tx))
+
+    def test_cpu(self):
+        self.write(150, 200, 0, 0, 0)
+        self.clock.sleep(2)
+        self.sampler.sample()
+        self.assertEqual(list(self.sampler.cpu_usage), [0.5, 1 / 3.0, 1 / 3.0])
+
+    def test_net(self):
+        self.assertEqual(self.sampler.interfaces, ["lo", "eth0"])
+        self.assertEqual(self.sampler.rates("eth0"), (0.0, 0.0))
+        self.write(100, 100, 10, 4000, 1000)
+        self.clock.sleep(4)
+        self.sampler.sample()
+        self.assertEqual(self.sampler.rates("eth0"), (1000.0, 250.0))
+        self.assertEqual(self.sampler.rates("wlan0"), None)
+
+    def test_once_per_interval(self):
+        arrays = self.sampler.cpu_usage, self.sampler.net_rates
+        first = self.sampler.cpu_usage[0]
+        self.write(150, 200, 0, 0, 0)
+        self.clock.sleep(0.5)
+        self.sampler.sample()
+        self.sampler.sample()
+        self.assertEqual(self.sampler.samples, 1)
+        self.assertEqual(self.sampler.cpu_usage[0], first)
+        self.clock.sleep(1.5)
+        self.sampler.sample()
+        self.assertEqual(self.sampler.samples, 2)
+        self.assertTrue(self.sampler.cpu_usage is arrays[0])
+        self.assertTrue(self.sampler.net_rates is arrays[1])
+
+    def test_jittered_ticks(self):
+        sampler = StatSampler(1, self.stat, self.netdev, self.clock)
+        for now in (101.003, 101.004, 102.001, 103.004, 104.002, 105.0015):
+            self.clock.now = now
+            sampler.sample()
+        # the first read is done when the sampler is created
+        self.assertEqual(sampler.samples, 6)
+
+    def test_concurrent_readers(self):
+        # the reader losing the interval check waits for the sample
+        # being taken instead of reading half written arrays
+        self.write(150, 200, 0, 0, 0)
+        self.clock.sleep(2)
+        read = self.sampler._sample_cpu
+        def slow_read():
+            time.sleep(0.05)
+            read()
+        self.sampler._sample_cpu = slow_read
+        first = threading.Thread(target=self.sampler.sample)
+        first.start()
+        time.sleep(0.01)
+        self.sampler.sample()
+        self.assertEqual(self.sampler.usage(), [0.5, 1 / 3.0, 1 / 3.0])
+        first.join()
+        self.assertEqual(self.sampler.samples, 2)
+
+
+class RegistryTest(unittest.TestCase):
+    def test_lookup(self):
+        import basicelements
+        self.assertTrue(registry.lookup("Time") is basicelements.Time)
+        self.assertRaises(KeyError, registry.lookup, "Nonexistent")
+
+    def test_create(self):
+        elm = registry.create("Time", dict(fmt="%Y"), size=6)
+        self.assertEqual(elm.next(), time.strftime("  %Y"))
+
+    def test_no_backend_imports(self):
+        code = ("import sys, registry\n"
+            "registry.create('Time'); registry.create('Load')\n"
+            "sys.exit(len(set(['dbus', 'gobject', 'alsaaudio'])"
+            " & set(sys.modules)))")
+        self.assertEqual(subprocess.call([sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__))), 0)
+
+
+class FakeMixer(object):
+    '''alsaaudio.Mixer whose events are bytes written to two pipes'''
+    def __init__(self):
+        self.pipes = [os.pipe(), os.pipe()]
+        self.volume, self.mute = 42, 0
+        self.reads = 0
+
+    def polldescriptors(self):
+        return [(r, select.POLLIN) for r, w in self.pipes]
+
+    def handleevents(self):
+        for r, w in self.pipes:
+            while select.select([r], [], [], 0)[0]:
+                os.read(r, 1)
+
+    def change(self, volume, pipe=1):
+        self.volume = volume
+        os.write(self.pipes[pipe][1], "x")
+
+    def getvolume(self):
+        self.reads += 1
+        return [self.volume]
+
+    def getmute(self):
+        return [self.mute]
+
+
+class AudioTest(unittest.TestCase):
+    def setUp(self):
+        self.mixer = FakeMixer()
+        alsaaudio = types.ModuleType("alsaaudio")
+        alsaaudio.Mixer = Mock(return_value=self.mixer)
+        with patch.dict("sys.modules", alsaaudio=alsaaudio):
+            self.elm = Audio(dict(colour=None))
+        self.Mixer = alsaaudio.Mixer
+
+    def tearDown(self):
+        for pipe in self.mixer.pipes:
+            map(os.close, pipe)
+
+    def test_reads_on_events_only(self):
+        self.assertTrue(self.elm.next().endswith(" 42%"))
+        for i in range(3):
+            self.elm.next()
+        self.assertEqual(self.mixer.reads, 1)
+        self.mixer.change(50)
+        self.assertTrue(self.elm.next().endswith(" 50%"))
+        self.elm.next()
+        self.assertEqual(self.mixer.reads, 2)
+        self.assertEqual(self.Mixer.call_count, 1)
+
+    def test_wakeup_all_descriptors(self):
+        fds = self.elm.wakeup_fds()
+        self.assertEqual(fds, [r for r, w in self.mixer.pipes])
+        self.elm.next()
+        self.mixer.change(7, pipe=0)
+        ready = select.select(fds, [], [], 0)[0]
+        self.assertEqual(ready, [fds[0]])
+        self.elm.handle_wakeup(fds[0])
+        self.assertEqual(select.select(fds, [], [], 0)[0], [])
+        self.assertTrue(self.elm.next().endswith(" 7%"))
+
+
+class BatteryTest(unittest.TestCase):
+    def setUp(self):
+        self.supply_dir = tempfile.mkdtemp()
+        self.write("BAT0", type="Battery", status="Discharging",
+                energy_now=30000, energy_full=40000)
+        self.write("BAT1", type="Battery", status="Discharging",
+                charge_now=5000, charge_full=10000, alarm=1000)
+        self.write("AC", type="Mains", online=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.supply_dir)
+
+    def write(self, name, **attrs):
+        path = os.path.join(self.supply_dir, name)
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        for attr, value in attrs.items():
+            with open(os.path.join(path, attr), "w") as f:
+                f.write("{0}\n".format(value))
+
+    def battery(self, **params):
+        params.update(supply_dir=self.supply_dir, colour_normal=None,
+                colour_warning=ForegroundColour("red"))
+        return Battery(params, interval=10)
+
+    def test_batteries(self):
+        elm = self.battery()
+        self.assertTrue(elm.update().endswith(" 75%/50%"))
+        self.assertEqual(elm.quantity, 0.7)
+        elm = self.battery(batteries=["BAT1"])
+        self.assertTrue(elm.update().endswith(" 50%"))
+        elm = self.battery(combined=True)
+        self.assertTrue(elm.update().endswith(" 70%"))
+
+    def test_static_cached(self):
+        elm = self.battery(combined=True)
+        elm.update()
+        self.write("BAT0", energy_full=60000, energy_now=20000)
+        self.assertTrue(elm.update().endswith(" 50%"))
+        self.write("BAT0", status="Charging")
+        self.assertTrue(elm.update().endswith(" 36%"))
+
+    def test_warning(self):
+        elm = self.battery(warning=0.2)
+        self.write("BAT0", energy_now=1000)
+        self.assertTrue(elm.update().startswith("^fg(red)"))
+        self.assertEqual(elm.interval, 2)
+
+    def test_adaptive_interval(self):
+        elm = self.battery()
+        elm.update()
+        self.assertEqual(elm.interval, 10)
+        elm.update()
+        self.assertEqual(elm.interval, 20)
+        elm.update()
+        self.assertEqual(elm.interval, 40)
+        self.write("BAT0", energy_now=20000)
+        elm.update()
+        self.assertEqual(elm.interval, 10)
+        self.write("BAT0", status="Charging")
+        self.write("BAT1", status="Full")
+        elm.update()
+        self.assertEqual(elm.interval, 60)
+
+    def test_no_battery(self):
+        for name in ("BAT0", "BAT1"):
+            shutil.rmtree(os.path.join(self.supply_dir, name))
+        self.assertTrue(self.battery().update().endswith(" AC"))
+
+
+class DiskUsageTest(unittest.TestCase):
+    def test_human_size(self):
+        for size, expected in ((0, "0"), (1023, "1023"), (1024, "1.0K"),
+                (1025, "1.1K"), (10 * 1024, "10K"), (10 * 1024 + 1, "11K"),
+                (1023 * 1024, "1023K"), (1023 * 1024 + 1, "1.0M"),
+                (1024 ** 3 - 1, "1.0G"), (5 * 1024 ** 4, "5.0T")):
+            self.assertEqual(human_size(size), expected)
+
+    def test_update(self):
+        # 1000 blocks of 4K: 250 free, 200 of them available to users
+        stat = posix.statvfs_result((4096, 4096, 1000, 250, 200, 0, 0, 0,
+            0, 255))
+        elm = DiskUsage(dict(partitions=(("root", "/"), ("usb", "/usb")),
+            fmt="{name}: {use} {used}/{size} {avail}"))
+        elm.mounts = set(["/"])
+        with patch("basicelements.os.statvfs", return_value=stat) as statvfs:
+            self.assertEqual(elm.update(),
+                    "root: 79% 3.0M/4.0M 800K usb: UNM")
+        statvfs.assert_called_once_with("/")
+
+    def test_empty_filesystem(self):
+        stat = posix.statvfs_result((4096, 4096, 0, 0, 0, 0, 0, 0, 0, 255))
+        elm = DiskUsage(dict(partitions=(("proc", "/proc"),)))
+        elm.mounts = set(["/proc"])
+        with patch("basicelements.os.statvfs", return_value=stat):
+            self.assertEqual(elm.update(), "proc: 0%")
+
+class ConfigTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.created = []
+        self.config = Config(self.path, self.create)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def create(self, name, *args, **kwargs):
+        elm = registry.create(name, *args, **kwargs)
+        elm.stop = Mock()
+        self.created.append(elm)
+        return elm
+
+    def write(self, bars, mtime):
+        with open(self.path, "w") as f:
+            json.dump(dict(bars=bars), f)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_load(self):
+        self.write([dict(args="-x 0", elements=[dict(type="Time", size=4,
+            params=dict(colour="red", fmt="%Y")), dict(type="Load")]),
+            dict(args="-x 1", elements=[dict(type="Time",
+            params=dict(colour="red", fmt="%Y"))])], 1)
+        self.config.load()
+        self.assertEqual([args for args, views in self.config.bars],
+                ["-x 0", "-x 1"])
+        self.assertEqual(len(self.created), 2)
+        views = self.config.all_views()
+        self.assertTrue(views[0].element is views[2].element)
+        self.assertEqual(views[0].next(), time.strftime("^fg(red)%Y^fg()"))
+        self.assertEqual(views[1].element.interval, 5)
+
+    def test_reload_keeps_unchanged(self):
+        time_elm = dict(type="Time", scroll=1)
+        self.write([dict(elements=[time_elm, dict(type="Load")])], 1)
+        self.config.load()
+        self.assertFalse(self.config.changed())
+        kept, dropped = self.config.all_views()
+        self.write([dict(elements=[time_elm,
+            dict(type="Load", interval=10)])], 2)
+        self.assertTrue(self.config.changed())
+        self.config.load()
+        views = self.config.all_views()
+        self.assertTrue(views[0] is kept)
+        self.assertEqual(views[1].element.interval, 10)
+        dropped.element.stop.assert_called_once_with()
+        self.assertFalse(kept.element.stop.called)
+
+    def test_invalid(self):
+        self.write([dict(elements=[dict(type="Time")])], 1)
+        self.config.load()
+        bars = self.config.bars
+        self.write([dict(elements=[dict(type="Load"),
+            dict(type="Nonexistent")])], 2)
+        self.assertRaises(ConfigError, self.config.load)
+        self.assertTrue(self.config.bars is bars)
+        self.created[1].stop.assert_called_once_with()
+        self.assertFalse(self.config.changed())
+
+    def test_malformed(self):
+        for bars in (["oops"], [dict(elements=["Time"])],
+                [dict(elements=[dict(type="Time", colour=3)])],
+                [dict(elements=[dict(type="Time", params=dict(colour=3))])],
+                [dict(elements=[dict(type="Time", size="4")])],
+                [dict(args=1, elements=[])]):
+            self.write(bars, 1)
+            self.assertRaises(ConfigError, self.config.load)
+        self.assertEqual(self.created, [])
+
+    def test_reload_exclusive(self):
+        class Exclusive(BarElement):
+            EXCLUSIVE = True
+            owner = None
+            def start(self):
+                if Exclusive.owner is not None:
+                    raise KeyError("taken")
+                Exclusive.owner = self
+            def stop(self):
+                Exclusive.owner = None
+        def create(name, *args, **kwargs):
+            if name == "Exclusive":
+                return Exclusive(*args, **kwargs)
+            return registry.create(name, *args, **kwargs)
+        self.config.create = create
+        self.write([dict(elements=[dict(type="Exclusive")])], 1)
+        self.config.load()
+        old = self.config.all_views()[0].element
+        self.write([dict(elements=[dict(type="Exclusive",
+            params=dict(x=1))])], 2)
+        self.config.load()
+        new = self.config.all_views()[0].element
+        self.assertTrue(Exclusive.owner is new and new is not old)
+        self.write([dict(elements=[dict(type="Exclusive"),
+            dict(type="Nonexistent")])], 3)
+        self.assertRaises(ConfigError, self.config.load)
+        self.assertTrue(Exclusive.owner is new)
+
+
+class SinkTest(unittest.TestCase):
+    def test_validate(self):
+        self.assertEqual(sink.validate_markup("^ca(1,ls)x^ca() ^fg(a)b"), [])
+        self.assertEqual(len(sink.validate_markup("a^b")), 1)
+        self.assertEqual(sink.validate_markup("^ca(ls)x^ca()"),
+                ["^ca(ls) without a button"])
+        self.assertEqual(sink.validate_markup("^ca(1,ls)x"),
+                ["1 click area(s) not closed"])
+        self.assertEqual(sink.validate_markup("x^ca()"),
+                ["^ca() closing no click area"])
+
+    def test_run(self):
+        log = StringIO.StringIO()
+        clock = iter([1.0, 2.5]).next
+        sink.run(StringIO.StringIO("^fg(red)a\nb^\n"), log, clock)
+        log.seek(0)
+        frames = list(sink.read_frames(log))
+        self.assertEqual([frame[:2] for frame in frames],
+                [(1.0, "^fg(red)a"), (2.5, "b^")])
+        self.assertEqual(frames[0][2], [])
+        self.assertEqual(len(frames[1][2]), 1)
+
+
+class ReplayTest(unittest.TestCase):
+    def test_record(self):
+        stream = StringIO.StringIO()
+        clock = FakeClock(10.0)
+        elm = BarElement()
+        elm.update = lambda static=["a", "a", "b"]: static.pop(0)
+        replay.Recorder([elm], stream, clock)
+        for i in range(3):
+            clock.sleep(1)
+            elm.next()
+        stream.seek(0)
+        trace = replay.read_trace(stream)
+        self.assertEqual([(event["t"], event["value"]) for event in trace],
+                [(1.0, "a"), (3.0, "b")])
+        self.assertEqual(trace[0]["type"], "BarElement")
+
+    def test_replay(self):
+        events = [dict(t=i * 0.1, element=i % 2, value="v{0}".format(i))
+                for i in range(6)]
+        replayer = replay.Replayer(events, speed=10)
+        frames = []
+        output = Mock()
+        output.write = lambda line: frames.append((time.time(), line, []))
+        replayer.run(output, settle=0.01)
+        self.assertEqual([value for when, element, value
+            in replayer.injected], ["v{0}".format(i) for i in range(6)])
+        result = replay.analyse(replayer.injected, frames)
+        self.assertEqual(result["missed"], 0)
+        self.assertEqual(result["events"], 6)
+        self.assertTrue(result["p100_ms"] < 1000)
+
+    def test_percentile(self):
+        self.assertEqual(replay.percentile(range(1, 101), 50), 50)
+        self.assertEqual(replay.percentile(range(1, 101), 99), 99)
+        self.assertEqual(replay.percentile([3], 90), 3)
+        self.assertEqual(replay.percentile([], 90), None)
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fifo = os.path.join(self.dir, "fifo")
+        self.socket = os.path.join(self.dir, "socket")
+        self.elm = Ingest(dict(fifo=self.fifo, socket=self.socket))
+
+    def tearDown(self):
+        self.elm.stop()
+        shutil.rmtree(self.dir)
+
+    def dispatch(self):
+        '''what the scheduler does with the ready descriptors'''
+        for i in range(5):
+            ready = select.select(self.elm.wakeup_fds(), [], [], 0.1)[0]
+            for fd in ready:
+                self.elm.handle_wakeup(fd)
+
+    def test_fifo(self):
+        self.assertEqual(self.elm.next(), " ")
+        self.assertFalse(self.elm.check_update())
+        fd = os.open(self.fifo, os.O_WRONLY)
+        os.write(fd, "mail\t3 new\nclock\t12:00\nmail\t4 n")
+        os.write(fd, "ew\n")
+        os.close(fd)
+        self.dispatch()
+        self.assertEqual(self.elm.next(), "4 new 12:00")
+        self.assertFalse(select.select(self.elm.wakeup_fds(), [], [], 0)[0])
+
+    def test_socket(self):
+        first = socket.socket(socket.AF_UNIX)
+        first.connect(self.socket)
+        first.sendall("^fg(red)broken^\nplain\t^fg(red)red\n")
+        self.dispatch()
+        self.assertEqual(self.elm.next(),
+                "^^fg(red)broken^^ ^fg(red)red^fg()")
+        second = socket.socket(socket.AF_UNIX)
+        second.connect(self.socket)
+        second.sendall("plain\t\nlast line")
+        second.close()
+        first.close()
+        self.dispatch()
+        self.assertEqual(self.elm.next(), "last line")
+        # only the fifo and the listening socket are left
+        self.assertEqual(len(self.elm.wakeup_fds()), 2)
+
+    def test_stop_keeps_replacement_socket(self):
+        replacement = Ingest(dict(socket=self.socket, separator="|"))
+        self.elm.stop()
+        self.assertTrue(os.path.exists(self.socket))
+        replacement.stop()
+        self.assertFalse(os.path.exists(self.socket))
+
+
+class StatusServerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "socket")
+        self.clock = FakeClock(0.5)
+        self.values = ["a", "^fg(red)b^fg()"]
+        first, second = BarElement(), BarElement(interval=5)
+        first.update = lambda: self.values[0]
+        second.update = lambda: self.values[1]
+        self.sched = Scheduler((first, View(second)), self.clock,
+                self.clock.sleep)
+        self.server = StatusServer(self.sched, self.path)
+        self.sched.tick(self.clock())
+        self.server.publish()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.dir)
+
+    def connect(self, command):
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(self.path)
+        sock.sendall(command + "\n")
+        for i in range(3):
+            self.sched.wait(0.1)
+        return sock.makefile()
+
+    def test_stale_socket(self):
+        path = os.path.join(self.dir, "stale")
+        dead = socket.socket(socket.AF_UNIX)
+        dead.bind(path)
+        dead.close()
+        server = StatusServer(self.sched, path)
+        server.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_running_bar(self):
+        with self.assertRaises(socket.error) as cm:
+            StatusServer(self.sched, self.path)
+        self.assertEqual(cm.exception.args[0], errno.EADDRINUSE)
+        self.assertEqual(self.connect("get BarElement").read(), "a\n")
+
+    def test_not_a_socket(self):
+        path = os.path.join(self.dir, "file")
+        open(path, "w").close()
+        self.assertRaises(socket.error, StatusServer, self.sched, path)
+        self.assertTrue(os.path.isfile(path))
+
+    def test_get(self):
+        answer = json.loads(self.connect("get").read())
+        self.assertEqual(answer, {
+            "BarElement": dict(value="a", markup="a", stale=False),
+            "BarElement.2": dict(value="b", markup="^fg(red)b^fg()",
+                stale=False)})
+        self.assertEqual(self.connect("get BarElement.2").read(), "b\n")
+        self.assertEqual(self.connect("get Nothing").read(), "\n")
+
+    def test_subscribe(self):
+        everything = self.connect("subscribe")
+        second = self.connect("subscribe BarElement.2")
+        self.assertEqual(len(json.loads(everything.readline())), 2)
+        self.assertEqual(second.readline(), "b\n")
+        self.values[0] = "c"
+        self.clock.sleep(1)
+        self.sched.tick(self.clock())
+        self.server.publish()
+        self.assertEqual(json.loads(everything.readline()),
+                {"BarElement": dict(value="c", markup="c", stale=False)})
+        self.values[1] = "d"
+        self.clock.sleep(5)
+        self.sched.tick(self.clock())
+        self.server.publish()
+        self.assertEqual(len(json.loads(everything.readline())), 1)
+        self.assertEqual(second.readline(), "d\n")
+
+    def test_no_clients(self):
+        self.server.snapshot = Mock()
+        self.server.publish()
+        self.assertFalse(self.server.snapshot.called)
+
+    def test_slow_subscriber(self):
+        reader = self.connect("subscribe BarElement")
+        reader.readline()
+        for i in range(1000):
+            self.values[0] = str(i) * 100
+            self.clock.sleep(1)
+            self.sched.tick(self.clock())
+            self.server.publish()
+            if self.sched.watched_write:
+                break
+        # the rest waits for the socket to be writable, without blocking
+        fd, client = self.server.clients.items()[0]
+        self.assertTrue(client["output"])
+        self.assertEqual(self.sched.watched_write.keys(), [fd])
+        received = ''
+        while not received.endswith(self.values[0] + "\n"):
+            received += os.read(reader.fileno(), 1 << 20)
+            self.sched.wait(0.1)
+        self.assertEqual(client["output"], '')
+        self.assertEqual(self.sched.watched_write, {})
+
+    def test_slow_reader_dropped(self):
+        self.server.max_buffer = 1000
+        reader = self.connect("subscribe BarElement")
+        for i in range(1000):
+            self.values[0] = str(i) * 100
+            self.clock.sleep(1)
+            self.sched.tick(self.clock())
+            self.server.publish()
+            if not self.server.clients:
+                break
+        self.assertEqual(self.server.clients, {})
+        self.assertEqual(self.sched.watched_write, {})
+
+    def test_query(self):
+        out = StringIO.StringIO()
+        done = threading.Event()
+        def serve():
+            while not done.is_set():
+                self.sched.wait(0.05)
+        thread = threading.Thread(target=serve)
+        thread.start()
+        query(["get", "BarElement"], self.path, out)
+        done.set()
+        thread.join()
+        self.assertEqual(out.getvalue(), "a\n")
+
+
 class GradientTest():#unittest.TestCase):
     def test_gradient_creation(self):
         grad_func = lambda: 0.5